@@ -27,11 +27,16 @@ OTHER DEALINGS IN THE SOFTWARE.
 # module for VEpycurl - the Very Easy interface to pycurl
 #
  
-from StringIO import StringIO
-import urllib
+from io import BytesIO
+try :
+    from urllib import urlencode
+except ImportError :
+    # Python 3
+    from urllib.parse import urlencode
 import pycurl
 import sys
-import os
+import tempfile
+import threading
  
 class VEpycurl() :
     """
@@ -70,9 +75,10 @@ class VEpycurl() :
         self.pco.setopt(pycurl.SSL_VERIFYPEER, verifySSL)
         self.pco.setopt(pycurl.SSL_VERIFYHOST, verifySSL)
         if useCookies == True :
-            cjf = os.tmpfile() # potential security risk here; see python documentation
-            self.pco.setopt(pycurl.COOKIEFILE, cjf.name)
-            self.pco.setopt(pycurl.COOKIEJAR,  cjf.name)
+            # kept open for as long as the handle, the file goes with it
+            self.cookieJar = tempfile.NamedTemporaryFile()
+            self.pco.setopt(pycurl.COOKIEFILE, self.cookieJar.name)
+            self.pco.setopt(pycurl.COOKIEJAR,  self.cookieJar.name)
         if useSOCKS :
             # if you wish to use SOCKS, it is configured through these parms
             self.pco.setopt(pycurl.PROXY,     proxy)
@@ -87,34 +93,230 @@ class VEpycurl() :
             self.pco.setopt(pycurl.DEBUGFUNCTION, self.debug)
         return
  
-    def perform(self, url, fields=None, headers=None) :
-        if fields :
-            # This is a POST and we have fields to handle
-            fields = urllib.urlencode(fields)
-            self.pco.setopt(pycurl.POST,       1)
-            self.pco.setopt(pycurl.POSTFIELDS, fields)
-        else :
-            # This is a GET, and we do nothing with fields
-            pass
-        pageContents = StringIO()
-        self.pco.setopt(pycurl.WRITEFUNCTION,  pageContents.write)
-        self.pco.setopt(pycurl.URL, url)
-        if headers :
-            self.pco.setopt(pycurl.HTTPHEADER, headers)
-        self.pco.perform()
-        self.pco.close()
-        self.pc = pageContents
+    def perform(self, url, fields=None, headers=None, close=True) :
+        self.pc = _prepare(self.pco, url, fields, headers)
+        try :
+            self.pco.perform()
+            _check(self.pco, url)
+        finally :
+            if close :
+                # pass close=False to keep the handle (and its connection)
+                # around for another perform()
+                self.pco.close()
         return
- 
+
     def results(self) :
         # return the page contents that were received in the most recent perform()
-        # self.pc is a StringIO object
+        # self.pc is a BytesIO object
         self.pc.seek(0)
         return self.pc
  
     def debug(self, debug_type, debug_msg) :
         print('debug(%d): %s' % (debug_type, debug_msg))
         return
+
+class HTTPError(IOError) :
+    """
+    Raised for a response with an HTTP error status, which code holds
+    """
+
+    def __init__(self, code, url) :
+        IOError.__init__(self, 'HTTP error %d from %s' % (code, url))
+        self.code = code
+
+def _check(pco, url) :
+    # raise HTTPError if the response to the request on pco is an HTTP error
+    code = pco.getinfo(pycurl.RESPONSE_CODE)
+    if code >= 400 :
+        raise HTTPError(code, url)
+
+def _prepare(pco, url, fields=None, headers=None) :
+    # point a handle at a new request, returns the BytesIO the body lands in
+    if fields :
+        # This is a POST and we have fields to handle
+        if isinstance(fields, dict) :
+            fields = urlencode(fields)
+        pco.setopt(pycurl.POST,       1)
+        pco.setopt(pycurl.POSTFIELDS, fields)
+    else :
+        # This is a GET, and we do nothing with fields
+        pco.setopt(pycurl.HTTPGET, 1)
+    pageContents = BytesIO()
+    pco.setopt(pycurl.WRITEFUNCTION,  pageContents.write)
+    pco.setopt(pycurl.URL, url)
+    if headers :
+        pco.setopt(pycurl.HTTPHEADER, headers)
+    return pageContents
+
+class VEpycurlMulti() :
+    """
+    A pool of reusable pycurl handles driven by a CurlMulti, so that many
+    requests can be in flight at once.  DNS lookups, SSL sessions and (where
+    libcurl supports it) connections are shared between all of the handles
+    and survive from one call to the next.
+
+    perform() runs a single request on a pooled handle, performMany() runs a
+    list of requests concurrently and yields them back as they finish, and
+    stream() yields the body of a single request as it arrives.
+    """
+
+    def __init__(self,
+                 maxHandles     = 10,           # most requests in flight at once
+                 userAgent      = 'Mozilla/4.0 (compatible; MSIE 8.0)',
+                 followLocation = 1,            # follow redirects?
+                 verifySSL      = 0,            # tell SSL to verify IDs?
+                 ) :
+        self.maxHandles     = maxHandles
+        self.userAgent      = userAgent
+        self.followLocation = followLocation
+        self.verifySSL      = verifySSL
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl, 'LOCK_DATA_CONNECT') :
+            # connection sharing needs libcurl 7.57 or newer
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+        self.multi = pycurl.CurlMulti()
+        self.multiLock = threading.Lock()
+        self.handles = []
+        self.handleLock = threading.Lock()
+        self.available = threading.Semaphore(maxHandles)
+        return
+
+    def _newHandle(self) :
+        pco = pycurl.Curl()
+        pco.setopt(pycurl.USERAGENT,      self.userAgent)
+        pco.setopt(pycurl.FOLLOWLOCATION, self.followLocation)
+        pco.setopt(pycurl.MAXREDIRS,      20)
+        pco.setopt(pycurl.CONNECTTIMEOUT, 30)
+        pco.setopt(pycurl.SSL_VERIFYPEER, self.verifySSL)
+        pco.setopt(pycurl.SSL_VERIFYHOST, self.verifySSL)
+        pco.setopt(pycurl.SHARE,          self.share)
+        return pco
+
+    def _acquire(self) :
+        self.available.acquire()
+        with self.handleLock :
+            if self.handles :
+                return self.handles.pop()
+        return self._newHandle()
+
+    def _release(self, pco) :
+        with self.handleLock :
+            self.handles.append(pco)
+        self.available.release()
+
+    def perform(self, url, fields=None, headers=None) :
+        # run one request on a pooled handle and return its BytesIO
+        pco = self._acquire()
+        try :
+            pc = _prepare(pco, url, fields, headers)
+            pco.perform()
+            _check(pco, url)
+        finally :
+            self._release(pco)
+        pc.seek(0)
+        return pc
+
+    def performMany(self, requests) :
+        """
+        Run a list of (url, fields, headers) tuples at once, yielding
+        (index, result) pairs in the order the transfers finish.  The result
+        is a BytesIO on success, the HTTPError of an HTTP error status or the
+        pycurl.error that ended the transfer.
+        """
+        pending = list(enumerate(requests))
+        pending.reverse()
+        running = {}
+        self.multiLock.acquire()
+        try :
+            while pending or running :
+                while pending and len(running) < self.maxHandles :
+                    index, (url, fields, headers) = pending.pop()
+                    pco = self._acquire()
+                    running[pco] = (index, url, _prepare(pco, url, fields, headers))
+                    self.multi.add_handle(pco)
+                while True :
+                    ret, active = self.multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM :
+                        break
+                while True :
+                    queued, done, failed = self.multi.info_read()
+                    for pco in done :
+                        index, url, pc = running[pco]
+                        try :
+                            _check(pco, url)
+                            pc.seek(0)
+                        except HTTPError as ex :
+                            pc = ex
+                        self._finish(pco, running)
+                        yield index, pc
+                    for pco, errno, errmsg in failed :
+                        index, url, pc = self._finish(pco, running)
+                        yield index, pycurl.error(errno, errmsg)
+                    if not queued :
+                        break
+                if running :
+                    self.multi.select(1.0)
+        finally :
+            # the caller may stop iterating early, hand back whatever is left
+            for pco in list(running.keys()) :
+                self._finish(pco, running)
+            self.multiLock.release()
+        return
+
+    def stream(self, url, fields=None, headers=None) :
+        """
+        Run one request on a pooled handle, yielding its body in pieces as
+        they arrive.  Raises HTTPError for an HTTP error status, or the
+        pycurl.error that ended the transfer, if any.
+        """
+        pco = self._acquire()
+        pieces = []
+        try :
+            _prepare(pco, url, fields, headers)
+            pco.setopt(pycurl.WRITEFUNCTION, pieces.append)
+        except :
+            self._release(pco)
+            raise
+        # a CurlMulti of its own, so that the caller holds no lock between pieces
+        multi = pycurl.CurlMulti()
+        multi.add_handle(pco)
+        try :
+            active = 1
+            while active :
+                while True :
+                    ret, active = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM :
+                        break
+                queued, done, failed = multi.info_read()
+                if pieces or done :
+                    # the status is known once the body starts
+                    _check(pco, url)
+                for piece in pieces :
+                    yield piece
+                del pieces[:]
+                for handle, errno, errmsg in failed :
+                    raise pycurl.error(errno, errmsg)
+                if active :
+                    multi.select(1.0)
+        finally :
+            multi.remove_handle(pco)
+            multi.close()
+            self._release(pco)
+        return
+
+    def _finish(self, pco, running) :
+        self.multi.remove_handle(pco)
+        self._release(pco)
+        return running.pop(pco)
+
+    def close(self) :
+        with self.handleLock :
+            for pco in self.handles :
+                pco.close()
+            self.handles = []
+        return
  
 try:
     # only call this once in a process.  see libcurl docs for more info.
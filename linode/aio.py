@@ -0,0 +1,201 @@
+# vim:ts=2:sw=2:expandtab
+"""
+An asyncio flavour of the Linode API client, requires Python 3.5 or newer.
+
+AsyncApi is generated from the same method table as api.Api, so every API
+method takes the same arguments and performs the same validation, but returns
+a coroutine instead of blocking:
+
+    linodes = await AsyncApi(key).linode_list()
+
+Requests are sent over a pool of keep-alive connections driven by the event
+loop, no threads are involved.
+
+This code is provided under an MIT-style license. Please refer to the LICENSE
+file in the root of the project for specifics.
+"""
+
+import asyncio
+import json
+from urllib.parse import urlencode, urlsplit
+
+try:
+  from . import api
+except ImportError:
+  import api
+
+class AsyncPool(object):
+  """A pool of keep-alive HTTP connections driven by the event loop.
+
+  Optional parameters:
+        size - Maximum number of connections open at once (default: 10)
+
+  Pass the same pool to several AsyncApi instances to share connections.
+  """
+
+  def __init__(self, size=10):
+    self.size = size
+    self.__idle = {}
+    self.__available = None
+
+  async def open(self, url, fields, headers):
+    """POSTs fields to url, returning the response body"""
+    if self.__available is None:
+      self.__available = asyncio.Semaphore(self.size)
+
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or '/'
+    body = urlencode(fields).encode('utf-8')
+
+    head = ['POST %s HTTP/1.1' % path,
+            'Host: %s' % parts.netloc,
+            'Content-Type: application/x-www-form-urlencoded',
+            'Content-Length: %d' % len(body)]
+    head += ['%s: %s' % (k, v) for k,v in headers.items()]
+    message = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+    key = (parts.hostname, port, secure)
+    async with self.__available:
+      idle = self.__idle.setdefault(key, [])
+      while True:
+        reused = bool(idle)
+        if reused:
+          reader, writer = idle.pop()
+        else:
+          reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                         ssl=secure or None)
+        try:
+          writer.write(message)
+          status, data, keep_alive = await self.__read_response(reader)
+          break
+        except (ConnectionError, asyncio.IncompleteReadError):
+          writer.close()
+          if not reused:
+            raise
+          # the server closed an idle connection, retry on a fresh one
+        except:
+          writer.close()
+          raise
+
+      if keep_alive:
+        idle.append((reader, writer))
+      else:
+        writer.close()
+
+    if status >= 400:
+      raise IOError('HTTP error %d from %s' % (status, url))
+    return data
+
+  async def __read_response(self, reader):
+    status_line = await reader.readuntil(b'\r\n')
+    version, status = status_line.split(None, 2)[:2]
+    headers = {}
+    while True:
+      line = await reader.readuntil(b'\r\n')
+      if line == b'\r\n':
+        break
+      k, v = line.decode('latin-1').split(':', 1)
+      headers[k.strip().lower()] = v.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    if version == b'HTTP/1.0':
+      keep_alive = headers.get('connection', '').lower() == 'keep-alive'
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+      chunks = []
+      while True:
+        size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+        if size == 0:
+          # skip any trailers
+          while (await reader.readuntil(b'\r\n')) != b'\r\n':
+            pass
+          break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+      data = b''.join(chunks)
+    elif 'content-length' in headers:
+      data = await reader.readexactly(int(headers['content-length']))
+    else:
+      data = await reader.read()
+      keep_alive = False
+
+    return int(status), data, keep_alive
+
+  def close(self):
+    """Closes all idle connections."""
+    for idle in self.__idle.values():
+      for reader, writer in idle:
+        writer.close()
+    self.__idle = {}
+
+class AsyncApi(api.Api):
+  """Linode API (version 2) client class for asyncio.
+
+  Instantiate with: AsyncApi(), or AsyncApi(optional parameters)
+
+  Takes the same optional parameters as Api, pool must be an AsyncPool.
+  The thread based features of Api do not apply: autobatch, rate limits,
+  retries, hedging, single-flight, statistics and spans raise TypeError,
+  and so do submit() and map(), gather the coroutines of the methods
+  instead.  Responses are not streamed, so the iter_ methods and the
+  fields= option of list methods raise Exception.
+
+  Every API method returns a coroutine resolving to the same result Api
+  would return, or raising ApiError.  Arguments are checked when the method
+  is called, so MissingRequiredArgument is raised before anything is
+  awaited.  With batching enabled API methods queue their request and return
+  None, await batchFlush() to send the batch.
+  """
+
+  _streaming = False
+
+  # options of Api that AsyncApi would ignore
+  _unsupported = ('autobatch', 'rate_limit', 'action_limits', 'retries',
+                  'hedge', 'singleflight', 'collect_stats', 'stats_hook',
+                  'span_exporter')
+
+  def __init__(self, key=None, batching=False, pool=None, **kw):
+    for k in self._unsupported:
+      if kw.get(k):
+        raise TypeError('AsyncApi does not support %s' % k)
+    if pool is None:
+      pool = AsyncPool()
+    api.Api.__init__(self, key, batching, pool, **kw)
+    self.__pool = pool
+
+  def submit(self, action, **params):
+    raise TypeError('AsyncApi does not support submit(), await the method')
+
+  def map(self, action, iterable, max_workers=None):
+    raise TypeError('AsyncApi does not support map(), gather the methods')
+
+  async def batchFlush(self):
+    """Sends the queued requests in batches of at most batch_size, all at
+    once, and returns their responses in order.  Raises Exception if not in
+    batching mode, and BatchError, holding the responses of the others, if
+    some of several batches fail."""
+    if not self.batching:
+      raise Exception('Cannot flush requests when not batching')
+
+    batch, self._Api__batch_cache = self._Api__batch_cache, []
+    chunks = [batch[i:i + self.batch_size]
+              for i in range(0, len(batch), self.batch_size)]
+    sends = [self._Api__send_request({ 'api_action' : 'batch',
+                                       'api_requestArray' : json.dumps(chunk) })
+             for chunk in chunks]
+    if len(sends) == 1:
+      return await sends[0]
+    outcomes = await asyncio.gather(*sends, return_exceptions=True)
+    return api._join_chunks(chunks, outcomes)
+
+  async def _columns(self, rows, kind):
+    # list methods given columns= hand over the coroutine of their rows
+    return api._columnar(await rows, kind)
+
+  async def _Api__send_request(self, request, actions=None):
+    # replaces the blocking Api.__send_request used by every API method
+    request, headers = self._prepare_request(request)
+    response = await self.__pool.open(api.LINODE_API_URL, request, headers)
+    return self._parse_response(response)
@@ -32,11 +32,33 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 
+from array import array
+from collections import deque
 from decimal import Decimal
-import logging
-import urllib
-import urllib2
+import codecs
 import copy
+import functools
+import logging
+import random
+import re
+import threading
+import time
+from types import MethodType
+
+try:
+  from urllib import urlencode
+except ImportError:
+  # Python 3
+  from urllib.parse import urlencode
+
+try:
+  from concurrent import futures
+except ImportError:
+  # Python 2 without the futures package, Api.submit and Api.map are disabled
+  futures = None
+
+# imported by _numpy() when columns are first built
+numpy = False
 
 try:
   import json
@@ -45,50 +67,234 @@ except:
   import simplejson as json
   FULL_BODIED_JSON = False
 
-try:
-  import requests
-  from types import MethodType
-
-  def requests_request(url, fields, headers):
-    return requests.Request(method="POST", url=url, headers=headers, data=fields)
-
-  def requests_open(request):
-    r = request.prepare()
-    s = requests.Session()
-    s.verify = True
-    response = s.send(r)
-    response.read = MethodType(lambda x: x.text, response)
-    return response
-
-  URLOPEN = requests_open
-  URLREQUEST = requests_request
-except:
-  try:
-    import VEpycurl
-    def vepycurl_request(url, fields, headers):
-      return (url, fields, headers)
-
-    def vepycurl_open(request):
-      c = VEpycurl.VEpycurl(verifySSL=2)
-      url, fields, headers = request
-      nh = [ '%s: %s' % (k, v) for k,v in headers.items()]
-      c.perform(url, fields, nh)
-      return c.results()
-
-    URLOPEN = vepycurl_open
-    URLREQUEST = vepycurl_request
-  except:
-    import warnings
-    ssl_message = 'using urllib instead of pycurl, urllib does not verify SSL remote certificates, there is a risk of compromised communication'
-    warnings.warn(ssl_message, RuntimeWarning)
-
-    def urllib_request(url, fields, headers):
-      fields = urllib.urlencode(fields)
-      return urllib2.Request(url, fields, headers)
-
-    URLOPEN = urllib2.urlopen
-    URLREQUEST = urllib_request
-
+# The transport is picked by the first Api rather than on import: importing
+# requests or initialising pycurl takes most of the time spent importing this
+# module, which short lived scripts pay on every run.
+_transport_lock = threading.Lock()
+TRANSPORT = None
+
+def load_transport():
+  """Picks the transport, requests if installed, then pycurl, then urllib,
+  and returns its name.  Sets URLOPEN, URLREQUEST, URLPOOL and
+  TRANSPORT_ERRORS, and defines RequestsPool or CurlPool.  Python 3.7 and
+  newer do this when one of those is first looked up, older versions when
+  the first Api is made."""
+  global TRANSPORT, URLOPEN, URLREQUEST, URLPOOL, TRANSPORT_ERRORS
+  global requests, requests_request, requests_open, requests_stream, RequestsPool
+  global VEpycurl, vepycurl_request, vepycurl_open, CurlPool
+  global urllib2, urllib_request
+  with _transport_lock:
+    if TRANSPORT is not None:
+      return TRANSPORT
+
+    try:
+      from httplib import HTTPException
+    except ImportError:
+      # Python 3
+      from http.client import HTTPException
+
+    try:
+      import requests
+
+      def requests_request(url, fields, headers):
+        if not isinstance(fields, dict):
+          # already urlencoded
+          headers = dict(headers)
+          headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return requests.Request(method="POST", url=url, headers=headers, data=fields)
+
+      def requests_open(request, session=None):
+        if session is None:
+          session = requests.Session()
+          session.verify = True
+        # through the session, so that its headers apply
+        r = session.prepare_request(request)
+        response = session.send(r)
+        response.raise_for_status()
+        response.read = MethodType(lambda x: x.text, response)
+        return response
+
+      def requests_stream(request, session=None):
+        if session is None:
+          session = requests.Session()
+          session.verify = True
+        r = session.prepare_request(request)
+        response = session.send(r, stream=True)
+        try:
+          response.raise_for_status()
+          for piece in response.iter_content(STREAM_CHUNK):
+            yield piece
+        finally:
+          response.close()
+
+      class RequestsPool(object):
+        """A pool of keep-alive connections for the requests transport.
+
+        Optional parameters:
+              size - Maximum number of pooled connections (default: 10)
+              max_idle - Seconds the pool may sit unused before its connections
+                         are dropped and reopened, None for no limit (default: None)
+              keep_alive - Reuse connections between requests (default: True)
+
+        Every Api creates its own pool, pass the same pool to several Api
+        instances to have them share connections.
+        """
+
+        def __init__(self, size=10, max_idle=None, keep_alive=True):
+          self.size = size
+          self.max_idle = max_idle
+          self.keep_alive = keep_alive
+          self.__lock = threading.Lock()
+          self.__session = None
+          self.__active = 0
+          self.__last_used = 0
+
+        def __new_session(self):
+          s = requests.Session()
+          s.verify = True
+          adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                  pool_maxsize=self.size,
+                                                  pool_block=True)
+          s.mount('https://', adapter)
+          s.mount('http://', adapter)
+          if not self.keep_alive:
+            s.headers['Connection'] = 'close'
+          return s
+
+        def __acquire(self):
+          with self.__lock:
+            idle = time.time() - self.__last_used
+            if (self.__session is not None and self.__active == 0 and
+                self.max_idle is not None and idle > self.max_idle):
+              self.__session.close()
+              self.__session = None
+            if self.__session is None:
+              self.__session = self.__new_session()
+            self.__active += 1
+            return self.__session
+
+        def __release(self):
+          with self.__lock:
+            self.__active -= 1
+            self.__last_used = time.time()
+
+        def open(self, request):
+          session = self.__acquire()
+          try:
+            return requests_open(request, session)
+          finally:
+            self.__release()
+
+        def stream(self, request):
+          """Sends request, yielding the response body in pieces as they arrive"""
+          session = self.__acquire()
+          try:
+            for piece in requests_stream(request, session):
+              yield piece
+          finally:
+            self.__release()
+
+        def close(self):
+          """Drops all pooled connections."""
+          with self.__lock:
+            if self.__session is not None:
+              self.__session.close()
+              self.__session = None
+
+      URLOPEN = requests_open
+      URLREQUEST = requests_request
+      URLPOOL = RequestsPool
+      TRANSPORT_ERRORS = (IOError, HTTPException)
+      TRANSPORT = 'requests'
+    except:
+      try:
+        import VEpycurl
+        def vepycurl_request(url, fields, headers):
+          return (url, fields, headers)
+
+        def vepycurl_open(request):
+          c = VEpycurl.VEpycurl(verifySSL=2)
+          url, fields, headers = request
+          nh = [ '%s: %s' % (k, v) for k,v in headers.items()]
+          c.perform(url, fields, nh)
+          return c.results()
+
+        class CurlPool(object):
+          """A pool of reusable pycurl handles for the pycurl transport.
+
+          Optional parameters:
+                size - Maximum number of handles, and so of requests in flight
+                       at once (default: 10)
+
+          Handles share their DNS, SSL session and connection caches, pass the
+          same pool to several Api instances to share them between clients.
+          """
+
+          def __init__(self, size=10):
+            self.size = size
+            self.__multi = VEpycurl.VEpycurlMulti(maxHandles=size, verifySSL=2)
+
+          def __split(self, request):
+            url, fields, headers = request
+            return (url, fields, [ '%s: %s' % (k, v) for k,v in headers.items()])
+
+          def open(self, request):
+            return self.__multi.perform(*self.__split(request))
+
+          def stream(self, request):
+            """Sends request, yielding the response body in pieces as they
+            arrive"""
+            return self.__multi.stream(*self.__split(request))
+
+          def open_many(self, requests):
+            """Sends several requests at once on the multi handle, yielding
+            (index, response) pairs as they complete.  A failed request
+            yields its transfer or HTTP error in place of the response."""
+            return self.__multi.performMany([self.__split(r) for r in requests])
+
+          def close(self):
+            """Closes all pooled handles."""
+            self.__multi.close()
+
+        URLOPEN = vepycurl_open
+        URLREQUEST = vepycurl_request
+        URLPOOL = CurlPool
+        TRANSPORT_ERRORS = (IOError, HTTPException, VEpycurl.pycurl.error)
+        TRANSPORT = 'pycurl'
+      except:
+        import warnings
+        ssl_message = 'using urllib instead of pycurl, urllib does not verify SSL remote certificates, there is a risk of compromised communication'
+        warnings.warn(ssl_message, RuntimeWarning)
+
+        try:
+          import urllib2
+        except ImportError:
+          # Python 3
+          import urllib.request as urllib2
+
+        def urllib_request(url, fields, headers):
+          if isinstance(fields, dict):
+            fields = urlencode(fields)
+          return urllib2.Request(url, fields.encode('utf-8'), headers)
+
+        URLOPEN = urllib2.urlopen
+        URLREQUEST = urllib_request
+        URLPOOL = None
+        TRANSPORT_ERRORS = (IOError, HTTPException)
+        TRANSPORT = 'urllib'
+
+  return TRANSPORT
+
+_TRANSPORT_NAMES = ('URLOPEN', 'URLREQUEST', 'URLPOOL', 'TRANSPORT_ERRORS',
+                    'RequestsPool', 'CurlPool')
+
+def __getattr__(name):
+  # module attribute lookups that fail end up here on Python 3.7 and newer
+  if name in _TRANSPORT_NAMES and TRANSPORT is None:
+    load_transport()
+    if name in globals():
+      return globals()[name]
+  raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 class MissingRequiredArgument(Exception):
   """Raised when a required parameter is missing."""
@@ -134,51 +340,990 @@ class ApiError(Exception):
   def __reduce__(self):
     return (self.__class__, (self.value, ))
 
+class BatchError(Exception):
+  """Raised when some of the chunks of a split batch could not be sent.
+
+  errors lists the exception of each chunk that failed, and results holds
+  the response of every call in order, with the exception of its chunk in
+  place of the response of a call that was never answered.  The calls of
+  the chunks that went through have been carried out.
+  """
+
+  def __init__(self, errors, results):
+    self.errors = errors
+    self.results = results
+  def __str__(self):
+    return '%d of %d calls failed: %r' % (
+      len([r for r in self.results if isinstance(r, Exception)]),
+      len(self.results), self.errors)
+  def __reduce__(self):
+    return (self.__class__, (self.errors, self.results))
+
+def _join_chunks(chunks, outcomes):
+  """Returns the responses of the chunks of a batch in order, outcomes holds
+  the list of responses or the exception of each chunk"""
+  results = []
+  errors = []
+  for chunk, outcome in zip(chunks, outcomes):
+    if isinstance(outcome, Exception):
+      errors.append(outcome)
+      results.extend([outcome] * len(chunk))
+    else:
+      results.extend(outcome)
+  if errors:
+    raise BatchError(errors, results)
+  return results
+
 class ApiInfo:
   valid_commands = {}
   valid_params   = {}
+  request_builders = {}
+  list_commands = {}
+  methods = {}
+  record_types = {}
 
 LINODE_API_URL = 'https://api.linode.com/api/'
 
+# bytes read from the network at a time by the iter_ methods
+STREAM_CHUNK = 65536
+
+# request records carry the action as record.api_action for structured handlers
+log = logging.getLogger('linode.api')
+
+REDACT = ('api_key', 'rootsshkey', 'rootpass')
+
+class Redacted(object):
+  """Wraps a request for logging, secrets are only stripped from it (and
+  from the requests of a batch) if the log record is actually formatted"""
+
+  def __init__(self, request):
+    self.request = request
+
+  @staticmethod
+  def redact(request):
+    clean = {}
+    for k, v in request.items():
+      if k.lower() in REDACT:
+        v = '{0}: xxxx REDACTED xxxx'.format(k.lower())
+      elif k.lower() == 'api_requestarray':
+        v = [Redacted.redact(r) for r in json.loads(v)]
+      clean[k] = v
+    return clean
+
+  def __str__(self):
+    return str(self.redact(self.request))
+
+def is_read_action(action):
+  """Returns True for API actions that only read, and so are safe to repeat"""
+  action = action.lower().replace('_', '.')
+  return (action.startswith('avail.') or action.endswith('.list') or
+          action == 'test.echo')
+
+def _percentile(samples, percent):
+  """Returns the given percentile of a list of numbers"""
+  ordered = sorted(samples)
+  index = int(round(percent / 100.0 * (len(ordered) - 1)))
+  return ordered[index]
+
+def _body_bytes(body):
+  """Returns the size of a response body, which the requests transport
+  hands over as text"""
+  if not isinstance(body, bytes):
+    body = body.encode('utf-8')
+  return len(body)
+
+# the most precise clock available for timing requests
+_clock = getattr(time, 'perf_counter', time.time)
+
+class _Histogram(object):
+  """Counts values and keeps the most recent ones for percentiles"""
+
+  def __init__(self, keep=1024):
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+    self.recent = deque(maxlen=keep)
+
+  def add(self, value):
+    self.count += 1
+    self.total += value
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+    self.recent.append(value)
+
+  def summary(self):
+    return {
+      'count': self.count,
+      'mean': self.total / float(self.count),
+      'min': self.min,
+      'max': self.max,
+      'p50': _percentile(self.recent, 50),
+      'p90': _percentile(self.recent, 90),
+      'p99': _percentile(self.recent, 99),
+    }
+
+PHASES = ('build', 'encode', 'network', 'decode', 'wrap')
+
+class Span(object):
+  """A timed request, or one call inside a batch request.
+
+  attributes holds what is known about it: the action, the redacted
+  parameters of calls in a batch, byte sizes and the time spent in each
+  phase.  error is the exception it failed with, or None.  The calls of a
+  batch are only timed as a whole, their start, end and duration are None.
+  """
+
+  def __init__(self, name, start, attributes=None):
+    self.name = name
+    self.start = start
+    self.end = None
+    self.attributes = attributes or {}
+    self.children = []
+    self.error = None
+
+  @property
+  def duration(self):
+    if self.start is None or self.end is None:
+      return None
+    return self.end - self.start
+
+  def child(self, name, attributes=None):
+    span = Span(name, None, attributes)
+    self.children.append(span)
+    return span
+
+  def finish(self, end, error=None):
+    self.end = end
+    self.error = error
+
+  def __repr__(self):
+    if self.duration is None:
+      return '<Span %s %r>' % (self.name, self.attributes)
+    return '<Span %s %.3fs %r>' % (self.name, self.duration, self.attributes)
+
+class InMemoryExporter(object):
+  """Span exporter that keeps every finished span in the spans list"""
+
+  def __init__(self):
+    self.spans = []
+    self.__lock = threading.Lock()
+
+  def export(self, span):
+    with self.__lock:
+      self.spans.append(span)
+
+  def clear(self):
+    with self.__lock:
+      self.spans = []
+
+def _http_status(ex):
+  """Returns the HTTP status code behind a transport exception, if any"""
+  response = getattr(ex, 'response', None)
+  if response is not None and hasattr(response, 'status_code'):
+    return response.status_code
+  code = getattr(ex, 'code', None)
+  if isinstance(code, int):
+    return code
+  return None
+
 VERSION = '0.0.1'
 
+from itertools import repeat as _repeat
+try:
+  from itertools import izip as _zip, imap as _map
+  from itertools import izip_longest as _zip_longest
+except ImportError:
+  # Python 3
+  _zip = zip
+  _map = map
+  from itertools import zip_longest as _zip_longest
+_drain = deque(maxlen=0).extend
+
+# Every key a LowerCaseDict has seen, mapped to one shared lower case copy,
+# and every key set (as a tuple) mapped to its lower case key tuple, so that
+# rows of a response share their keys instead of lowering them again.
+_lowered = {}
+_lowered_keysets = {}
+
+def _lower(key):
+  low = key.lower()
+  if len(_lowered) > 8192:
+    _lowered.clear()
+  low = _lowered.setdefault(low, low)
+  _lowered[key] = low
+  return low
+
+def _lower_keys(keys):
+  if len(_lowered_keysets) > 1024:
+    _lowered_keysets.clear()
+  low = tuple([_lowered.get(k) or _lower(k) for k in keys])
+  _lowered_keysets[keys] = low
+  return low
+
 class LowerCaseDict(dict):
+  __slots__ = ()
+
   def __init__(self, copy=None):
     if copy:
-      if isinstance(copy, dict):
-        for k,v in copy.items():
-          dict.__setitem__(self, k.lower(), v)
+      if isinstance(copy, LowerCaseDict):
+        dict.__init__(self, copy)
+      elif isinstance(copy, Record):
+        dict.__init__(self, copy.items())
+      elif isinstance(copy, dict):
+        keys = tuple(copy)
+        low = _lowered_keysets.get(keys) or _lower_keys(keys)
+        dict.__init__(self, _zip(low, copy.values()))
       else:
-        for k,v in copy:
-          dict.__setitem__(self, k.lower(), v)
+        dict.__init__(self, [(_lowered.get(k) or _lower(k), v) for k,v in copy])
 
   def __getitem__(self, key):
-    return dict.__getitem__(self, key.lower())
+    return dict.__getitem__(self, _lowered.get(key) or _lower(key))
 
   def __setitem__(self, key, value):
-    dict.__setitem__(self, key.lower(), value)
+    dict.__setitem__(self, _lowered.get(key) or _lower(key), value)
+
+  def __delitem__(self, key):
+    dict.__delitem__(self, _lowered.get(key) or _lower(key))
 
   def __contains__(self, key):
-    return dict.__contains__(self, key.lower())
+    return dict.__contains__(self, _lowered.get(key) or _lower(key))
 
   def get(self, key, def_val=None):
-    return dict.get(self, key.lower(), def_val)
+    return dict.get(self, _lowered.get(key) or _lower(key), def_val)
 
   def setdefault(self, key, def_val=None):
-    return dict.setdefault(self, key.lower(), def_val)
+    return dict.setdefault(self, _lowered.get(key) or _lower(key), def_val)
 
   def update(self, copy):
-    for k,v in copy.items():
-      dict.__setitem__(self, k.lower(), v)
+    dict.update(self, LowerCaseDict(copy))
 
   def fromkeys(self, iterable, value=None):
     d = self.__class__()
     for k in iterable:
-      dict.__setitem__(d, k.lower(), value)
+      dict.__setitem__(d, _lowered.get(k) or _lower(k), value)
     return d
 
   def pop(self, key, def_val=None):
-    return dict.pop(self, key.lower(), def_val)
+    return dict.pop(self, _lowered.get(key) or _lower(key), def_val)
+
+_identifier = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+class Record(object):
+  """A row of an API response, holding each field listed in the returns
+  metadata of its method in a slot instead of a dictionary.
+
+  Fields read in any case as attributes or items, row.label, row.LABEL or
+  row['Label'], and are listed lower case by keys(), like LowerCaseDict.
+  Records are read-only mappings otherwise: get(), items(), len() and
+  comparison with dictionaries all work.  Fields the metadata doesn't list
+  are kept in a dictionary on the side.
+  """
+  __slots__ = ('_extra', )
+  _action = None
+  _fields = ()
+  _fieldset = frozenset()
+
+  def __init__(self, row=None):
+    self._extra = None
+    for k, v in (row or {}).items():
+      self[k] = v
+
+  @classmethod
+  def from_row(cls, row):
+    """Builds a record from a decoded row"""
+    keys = tuple(row)
+    layout = cls._layouts.get(keys)
+    if layout is None:
+      layout = cls._layout(keys)
+    names, setter = layout
+    record = cls.__new__(cls)
+    record._extra = None
+    # mapping setattr keeps the loop over the fields in C
+    _drain(_map(setter, _repeat(record), names, row.values()))
+    return record
+
+  @classmethod
+  def _layout(cls, keys):
+    # the rows of an action share their keys, so lower them once
+    names = tuple([_lowered.get(k) or _lower(k) for k in keys])
+    if cls._fieldset.issuperset(names):
+      layout = (names, setattr)
+    else:
+      layout = (names, Record.__setitem__)
+    if len(cls._layouts) > 64:
+      cls._layouts.clear()
+    cls._layouts[keys] = layout
+    return layout
+
+  def _set_extra(self, key, value):
+    if self._extra is None:
+      self._extra = {}
+    self._extra[key] = value
+
+  def __getattr__(self, name):
+    # only called when name isn't a set slot
+    low = _lowered.get(name) or _lower(name)
+    if low in self._fieldset and low != name:
+      return getattr(self, low)
+    if self._extra is not None and low in self._extra:
+      return self._extra[low]
+    raise AttributeError(name)
+
+  def __getitem__(self, key):
+    low = _lowered.get(key) or _lower(key)
+    try:
+      if low in self._fieldset:
+        return getattr(self, low)
+      if self._extra is not None:
+        return self._extra[low]
+    except (AttributeError, KeyError):
+      pass
+    raise KeyError(key)
+
+  def __setitem__(self, key, value):
+    low = _lowered.get(key) or _lower(key)
+    if low in self._fieldset:
+      setattr(self, low, value)
+    else:
+      self._set_extra(low, value)
+
+  def __contains__(self, key):
+    try:
+      self[key]
+    except KeyError:
+      return False
+    return True
+
+  def get(self, key, def_val=None):
+    try:
+      return self[key]
+    except KeyError:
+      return def_val
+
+  def keys(self):
+    keys = [f for f in self._fields if hasattr(self, f)]
+    if self._extra is not None:
+      keys.extend(self._extra)
+    return keys
+
+  def values(self):
+    return [self[k] for k in self.keys()]
+
+  def items(self):
+    return [(k, self[k]) for k in self.keys()]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def __eq__(self, other):
+    if isinstance(other, Record):
+      other = other.items()
+    elif isinstance(other, dict):
+      other = LowerCaseDict(other).items()
+    else:
+      return NotImplemented
+    return dict(self.items()) == dict(other)
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    if equal is NotImplemented:
+      return equal
+    return not equal
+
+  __hash__ = None
+
+  def __repr__(self):
+    return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+  def __reduce__(self):
+    return (_record, (self._action, self.items()))
+
+def _record(action, items):
+  # unpickles a Record
+  return _record_class(action).from_row(dict(items))
+
+def record_type(action, fields):
+  """Makes the Record class for action, with a slot per field"""
+  slots = []
+  for f in fields:
+    f = f.lower()
+    if _identifier.match(f) and f not in slots and not hasattr(Record, f):
+      slots.append(f)
+  name = ''.join([p.capitalize() for p in action.split('_')]) + 'Record'
+  return type(name, (Record, ), {'__slots__': tuple(slots),
+                                 '_action': action,
+                                 '_fields': tuple(slots),
+                                 '_fieldset': frozenset(slots),
+                                 '_layouts': {}})
+
+def _record_class(action):
+  """Returns the Record class for action, made on first use from the returns
+  metadata of its method, or None when it has none"""
+  action = action.lower().replace('.', '_')
+  cls = ApiInfo.record_types.get(action)
+  if cls is None and action in ApiInfo.methods:
+    returns = ApiInfo.methods[action][2]
+    if not returns:
+      return None
+    schema = returns[0] if isinstance(returns, list) else returns
+    # another thread may have made it meanwhile, keep the first
+    cls = ApiInfo.record_types.setdefault(action,
+                                          record_type(action, schema.keys()))
+  return cls
+
+def _as_records(action, data):
+  """Turns the rows of the DATA of action into Records, if it has a type"""
+  cls = _record_class(action)
+  if cls is None:
+    return data
+  if isinstance(data, list):
+    return [cls.from_row(r) if isinstance(r, dict) else r for r in data]
+  if isinstance(data, dict):
+    return cls.from_row(data)
+  return data
+
+class LazyNumber(object):
+  """A JSON number with a fraction, kept as its text until it is used.
+
+  It acts as the Decimal it stands for, decoded when first used: arithmetic
+  and comparisons work, and mixed with a float it acts as a float.  str()
+  gives the text back; convert with decimal(), float() or int().  Like a
+  Decimal, json.dumps() needs a default to write it.
+  """
+  __slots__ = ('text', '__value')
+
+  def __init__(self, text):
+    self.text = text
+    self.__value = None
+
+  def decimal(self):
+    if self.__value is None:
+      self.__value = Decimal(self.text)
+    return self.__value
+
+  def __float__(self):
+    return float(self.text)
+
+  def __int__(self):
+    return int(self.decimal())
+  __long__ = __int__
+
+  def __bool__(self):
+    return bool(self.decimal())
+  __nonzero__ = __bool__
+
+  def __hash__(self):
+    return hash(self.decimal())
+
+  def __str__(self):
+    return str(self.text)
+
+  def __repr__(self):
+    return 'LazyNumber(%r)' % str(self.text)
+
+  def __reduce__(self):
+    return (self.__class__, (self.text, ))
+
+def _lazy_method(name):
+  def method(self, *args):
+    value = self.decimal()
+    if args and isinstance(args[0], LazyNumber):
+      args = (args[0].decimal(), ) + args[1:]
+    elif args and isinstance(args[0], float):
+      # Decimal refuses to mix with floats
+      value = float(self)
+    return getattr(value, name)(*args)
+  method.__name__ = name
+  return method
+
+for _name in ('add', 'sub', 'mul', 'truediv', 'div', 'floordiv', 'mod',
+              'divmod', 'pow', 'radd', 'rsub', 'rmul', 'rtruediv', 'rdiv',
+              'rfloordiv', 'rmod', 'rdivmod', 'rpow', 'neg', 'pos', 'abs',
+              'round', 'eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+  _name = '__%s__' % _name
+  if hasattr(Decimal, _name):
+    setattr(LazyNumber, _name, _lazy_method(_name))
+
+NUMBER_MODES = ('decimal', 'float', 'lazy')
+
+_json_backends = {}
+_json_preference = []
+
+def register_json_backend(name, factory, takes_bytes=False):
+  """Makes a JSON library available as Api(json_backend=name).
+
+  factory(numbers) returns a function decoding a response, or None if the
+  library can't decode numbers with a fraction as asked: 'decimal' for
+  Decimal, 'float' for float or 'lazy' for LazyNumber.  takes_bytes says
+  whether that function accepts the undecoded response.  Backends
+  registered later are tried first when no json_backend is given.
+  """
+  _json_backends[name] = (factory, takes_bytes)
+  if name in _json_preference:
+    _json_preference.remove(name)
+  _json_preference.insert(0, name)
+
+def json_backends():
+  """Returns the names of the usable JSON backends, fastest first.  This
+  imports every registered library."""
+  return [name for name in _json_preference if _json_loads(name, 'float')]
+
+def _json_loads(name, numbers):
+  # the backend's decoder, or None when numbers can't be decoded as asked
+  # or the library is not installed
+  try:
+    return _json_backends[name][0](numbers)
+  except ImportError:
+    return None
+
+def json_decoder(backend=None, numbers='decimal'):
+  """Returns (name, loads, takes_bytes) for backend, or for the fastest
+  backend that can decode numbers as asked.  When backend can't, the
+  standard library json module is used instead."""
+  if numbers not in NUMBER_MODES:
+    raise ValueError('numbers must be one of %s' % ', '.join(NUMBER_MODES))
+  if backend is None:
+    names = _json_preference
+  elif backend in _json_backends and _json_loads(backend, 'float'):
+    names = [backend, 'json']
+  else:
+    raise ValueError('Unknown JSON backend %r, have %s' %
+                     (backend, ', '.join(json_backends())))
+  for name in names:
+    loads = _json_loads(name, numbers)
+    if loads is not None:
+      return name, loads, _json_backends[name][1]
+
+def _stdlib_loads(numbers):
+  # also used for simplejson, which stands in for json on old Pythons
+  if numbers == 'decimal':
+    return functools.partial(json.loads, parse_float=Decimal)
+  if numbers == 'lazy':
+    return functools.partial(json.loads, parse_float=LazyNumber)
+  return json.loads
+
+register_json_backend('json', _stdlib_loads)
+
+def _simplejson_loads(numbers):
+  import simplejson
+  return functools.partial(simplejson.loads,
+                           parse_float={'decimal': Decimal,
+                                        'lazy': LazyNumber}.get(numbers, float))
+
+def _ujson_loads(numbers):
+  if numbers != 'float':
+    return None
+  import ujson
+  return ujson.loads
+
+def _rapidjson_loads(numbers):
+  if numbers not in ('float', 'decimal'):
+    return None
+  import rapidjson
+  if numbers == 'decimal':
+    return functools.partial(rapidjson.loads, number_mode=rapidjson.NM_DECIMAL)
+  return rapidjson.loads
+
+def _orjson_loads(numbers):
+  if numbers != 'float':
+    return None
+  import orjson
+  return orjson.loads
+
+# imported by the first Api that picks them, as json_decoder tries each
+register_json_backend('simplejson', _simplejson_loads)
+register_json_backend('ujson', _ujson_loads, takes_bytes=True)
+register_json_backend('rapidjson', _rapidjson_loads)
+register_json_backend('orjson', _orjson_loads, takes_bytes=True)
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+class _JsonStream(object):
+  """Decodes JSON values one at a time from an iterator of pieces of a
+  UTF-8 document, reading only as much of it as each value needs."""
+
+  def __init__(self, pieces, decoder):
+    self.pieces = iter(pieces)
+    self.decoder = decoder
+    self.__utf8 = codecs.getincrementaldecoder('utf-8')()
+    self.buf = u''
+    self.pos = 0
+    self.done = False
+
+  def read(self, size=1):
+    """Reads until at least size characters are buffered past pos, returns
+    False once the document has ended"""
+    text = []
+    have = len(self.buf) - self.pos
+    while have < size and not self.done:
+      try:
+        piece = next(self.pieces)
+      except StopIteration:
+        self.done = True
+        piece = self.__utf8.decode(b'', True)
+      else:
+        piece = self.__utf8.decode(piece)
+      text.append(piece)
+      have += len(piece)
+    # drop what has been decoded already
+    self.buf = self.buf[self.pos:] + u''.join(text)
+    self.pos = 0
+    return have >= size
+
+  def peek(self):
+    """Skips whitespace, returns the next character or '' at the end"""
+    while True:
+      self.pos = _whitespace.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.read():
+        return ''
+
+  def expect(self, chars):
+    """Consumes the next character, which must be one of chars"""
+    c = self.peek()
+    if not c or c not in chars:
+      raise ValueError('Expected one of %r at %r' %
+                       (chars, self.buf[self.pos:self.pos + 20]))
+    self.pos += 1
+    return c
+
+  def value(self):
+    """Decodes the next value"""
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+        # a number at the very end of the buffer may yet have more digits
+        if end < len(self.buf) or self.done:
+          self.pos = end
+          return value
+      except ValueError:
+        if self.done:
+          raise
+      # double what is buffered, so long values are decoded in linear time
+      self.read(2 * (len(self.buf) - self.pos))
+
+  def array(self):
+    """Decodes the next value, which must be an array, yielding its
+    elements as they are decoded"""
+    self.expect('[')
+    if self.peek() == ']':
+      self.pos += 1
+      return
+    scan = self.decoder.scan_once
+    while True:
+      # fast path, for when the element starts at pos and is followed by
+      # its separator
+      buf = self.buf
+      try:
+        value, end = scan(buf, self.pos)
+      except (StopIteration, ValueError):
+        end = len(buf)
+      if end < len(buf):
+        self.pos = end
+      else:
+        value = self.value()
+      yield value
+      c = self.buf[self.pos:self.pos + 1]
+      if c == ',':
+        self.pos = _whitespace.match(self.buf, self.pos + 1).end()
+      elif c == ']':
+        self.pos += 1
+        return
+      elif self.expect(',]') == ']':
+        return
+
+  def close(self):
+    close = getattr(self.pieces, 'close', None)
+    if close is not None:
+      close()
+
+def _project(rows, fields):
+  """Yields the rows keeping only fields, compared case insensitively"""
+  wanted = frozenset([f.lower() for f in fields])
+  # rows of one response share their keys, so work out which to keep once
+  keep = {}
+  for row in rows:
+    if isinstance(row, dict):
+      keys = tuple(row)
+      kept = keep.get(keys)
+      if kept is None:
+        kept = keep[keys] = [k for k in keys
+                             if (_lowered.get(k) or _lower(k)) in wanted]
+      row = dict([(k, row[k]) for k in kept])
+    yield row
+
+try:
+  _integers = (int, long)
+  _texts = (str, unicode)
+except NameError:
+  # Python 3
+  _integers = (int, )
+  _texts = (str, )
+
+try:
+  array('q')
+  _INT64 = 'q'
+except ValueError:
+  # Python 2 has no 'q', 'l' is 64 bits on 64 bit Unix
+  _INT64 = 'l'
+
+class DictColumn(object):
+  """A dictionary encoded column of text: the value of row i is
+  values[codes[i]]."""
+  __slots__ = ('codes', 'values')
+
+  def __init__(self, codes, values):
+    self.codes = codes
+    self.values = values
+
+  def __len__(self):
+    return len(self.codes)
+
+  def __getitem__(self, i):
+    return self.values[self.codes[i]]
+
+  def decode(self):
+    """Returns the column as a plain list"""
+    return [self.values[c] for c in self.codes]
+
+  def __repr__(self):
+    return 'DictColumn(%d rows, %d values)' % (len(self.codes), len(self.values))
+
+def _numpy():
+  # numpy, or None when it is not installed
+  global numpy
+  if numpy is False:
+    try:
+      import numpy
+    except ImportError:
+      # columns are built with the array module instead
+      numpy = None
+  return numpy
+
+def _vector(typecode, values):
+  if _numpy() is not None:
+    return numpy.array(values, dtype={'d': numpy.float64}.get(typecode, numpy.int64))
+  return array(typecode, values)
+
+def _column(values):
+  """Picks the most compact form for a column of values"""
+  types = set(_map(type, values))
+  types.discard(type(None))
+  try:
+    if not types:
+      pass
+    elif all([issubclass(t, _integers) for t in types]) and None not in values:
+      return _vector(_INT64, values)
+    elif all([issubclass(t, _integers + (float, Decimal, LazyNumber))
+              for t in types]):
+      nan = float('nan')
+      return _vector('d', [nan if v is None else float(v) for v in values])
+    elif all([issubclass(t, _texts) for t in types]):
+      index = {}
+      codes = [index.setdefault(v, len(index)) for v in values]
+      if _numpy() is not None:
+        codes = numpy.array(codes, dtype=numpy.int32)
+      else:
+        codes = array('i', codes)
+      return DictColumn(codes, sorted(index, key=index.get))
+  except OverflowError:
+    pass
+  if _numpy() is not None:
+    column = numpy.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+  return list(values)
+
+def to_columns(rows):
+  """Turns the rows of a list response into a LowerCaseDict of columns.
+
+  Columns of integers become int64 vectors and columns of other numbers
+  float64 vectors, with NaN for missing values.  Columns of text become a
+  DictColumn.  Vectors are NumPy arrays when NumPy is installed and
+  array.array otherwise.  Anything else is kept in a list, or a NumPy
+  object array.
+  """
+  names = None
+  layout = None
+  ragged = False
+  table = []
+  for row in rows:
+    keys = tuple(row)
+    if keys == layout:
+      table.append(tuple(row.values()))
+    elif names is None:
+      names = [_lowered.get(k) or _lower(k) for k in keys]
+      layout = keys
+      table.append(tuple(row.values()))
+    else:
+      # a row with other fields, line it up with the columns so far
+      row = LowerCaseDict(row)
+      names.extend([k for k in row if k not in names])
+      table.append(tuple([row.get(k) for k in names]))
+      ragged = True
+
+  columns = LowerCaseDict()
+  if names is not None:
+    # transposing with zip keeps the loop over the rows in C
+    transposed = _zip_longest(*table) if ragged else _zip(*table)
+    for name, values in _zip(names, transposed):
+      columns[name] = _column(values)
+  return columns
+
+def to_structured(columns):
+  """Returns the columns made by to_columns as a NumPy record array, text
+  columns are decoded.  Requires NumPy."""
+  if _numpy() is None:
+    raise Exception('Structured arrays require numpy, install the numpy package')
+  names = list(columns.keys())
+  arrays = []
+  for name in names:
+    column = columns[name]
+    if isinstance(column, DictColumn):
+      values = numpy.array(column.values, dtype=None if None not in column.values
+                                                else object)
+      column = values[numpy.asarray(column.codes)]
+    arrays.append(numpy.asarray(column))
+  return numpy.rec.fromarrays(arrays, names=[str(n) for n in names])
+
+def _columnar(rows, kind):
+  columns = to_columns(rows)
+  if kind == 'structured':
+    return to_structured(columns)
+  return columns
+
+class _Flight(object):
+  """A request in flight that other callers may wait on"""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+  def wait(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+class TokenBucket(object):
+  """Paces calls to a steady rate while allowing short bursts.
+
+  Instantiate with: TokenBucket(rate), or TokenBucket(rate, burst)
+
+        rate - Calls allowed per second
+        burst - Calls that may go out at once after a quiet spell
+                (default: rate, at least 1)
+
+  The rate adapts to the API: slow_down() halves it when the API pushes
+  back, and every call that goes through afterwards wins a little of it
+  back, up to the rate the bucket was created with.  A bucket may be shared
+  between several Api instances.
+  """
+
+  def __init__(self, rate, burst=None):
+    self.max_rate = float(rate)
+    self.rate = self.max_rate
+    if burst is None:
+      burst = max(1, rate)
+    self.burst = float(burst)
+    self.__tokens = self.burst
+    self.__stamp = time.time()
+    self.__lock = threading.Lock()
+
+  def acquire(self, tokens=1):
+    """Blocks until tokens calls may be made"""
+    while True:
+      with self.__lock:
+        now = time.time()
+        self.__tokens = min(self.burst,
+                            self.__tokens + (now - self.__stamp) * self.rate)
+        self.__stamp = now
+        # a batch larger than the burst goes out once the bucket is full
+        if self.__tokens >= min(tokens, self.burst):
+          self.__tokens -= tokens
+          return
+        wait = (min(tokens, self.burst) - self.__tokens) / self.rate
+      time.sleep(wait)
+
+  def slow_down(self):
+    """Halves the rate, down to 1/64th of the original"""
+    with self.__lock:
+      self.rate = max(self.max_rate / 64, self.rate / 2)
+
+  def speed_up(self):
+    """Wins back 1/16th of the original rate"""
+    with self.__lock:
+      self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+def _method_doc(doc, required, optional, returns, streams=False):
+  """Adds the parameters and returns metadata of an API method to doc"""
+  if (required or optional) and doc:
+    # Generate parameter documentation in docstring
+    if len(doc.split('\n')) == 1:  # one-liners need whitespace
+      doc += '\n'
+    doc += '\n    Keyword arguments (* = required):\n'
+    doc += ''.join(['\t *%s\n' % p for p in required])
+    doc += ''.join(['\t  %s\n' % p for p in optional])
+
+  if returns and doc:
+    # we either have a list of dicts or a just plain dict
+    if len(doc.split('\n')) == 1:  # one-liners need whitespace
+      doc += '\n'
+    if isinstance(returns, list):
+      width = max(len(q) for q in returns[0].keys())
+      doc += '\n    Returns list of dictionaries:\n\t[{\n'
+      doc += ''.join(['\t  %-*s: %s\n'
+                      % (width, p, returns[0][p]) for p in returns[0].keys()])
+      doc += '\t }, ...]\n'
+      if streams:
+        doc += ('\n    fields=[...] keeps only those fields of each row.'
+                '\n    columns=True returns the rows as columns, see to_columns(),'
+                '\n    and columns=\'structured\' as a NumPy record array.  Either'
+                '\n    sends the call straight away, even when batching.\n')
+    else:
+      width = max(len(q) for q in returns.keys())
+      doc += '\n    Returns dictionary:\n\t {\n'
+      doc += ''.join(['\t  %-*s: %s\n'
+                      % (width, p, returns[p]) for p in returns.keys()])
+      doc += '\t }\n'
+  return doc
+
+class _ApiMethod(object):
+  # An API method of Api.  Writing the docstrings of every method took a
+  # good part of importing api, so each is written when first read.
+
+  def __init__(self, func, doc, required, optional, returns, streams=False):
+    self.func = func
+    self.__name__ = func.__name__
+    self.__meta = (doc, required, optional, returns, streams)
+    self.__doc = None
+
+  @property
+  def __doc__(self):
+    if self.__doc is None:
+      self.__doc = _method_doc(*self.__meta)
+    return self.__doc
+
+  def __get__(self, obj, cls=None):
+    # bound on Api instances only, oop classes keep them as update_method
+    if isinstance(obj, Api):
+      return MethodType(self, obj)
+    return self
+
+  def __call__(self, *args, **kw):
+    return self.func(*args, **kw)
+
+  def __repr__(self):
+    return '<Api method %s>' % self.__name__
 
 class Api:
   """Linode API (version 2) client class.
@@ -188,6 +1333,62 @@ class Api:
   Optional parameters:
         key - Your API key, from "My Profile" in the LPM (default: None)
         batching - Enable batching support (default: False)
+        pool - Connection pool to send requests through, may be shared
+               between several Api instances (default: a new pool when
+               the transport supports one)
+        max_workers - Size of the thread pool used by submit() and map()
+                      (default: 8)
+        autobatch - Queue every call and send the queue as one batch once it
+                    holds batch_size calls or batch_window seconds have
+                    passed, calls return a Future for their own result
+                    (default: False)
+        batch_size - Most calls sent in one batch request, larger batches
+                     are split and sent concurrently (default: 25)
+        batch_window - Longest a call waits in the automatic batch queue, in
+                       seconds (default: 0.05)
+        rate_limit - Calls per second allowed for this client, or a
+                     TokenBucket to share with other clients (default: None)
+        action_limits - Dictionary of per action rate limits, e.g.
+                        {'linode.create': 0.5} (default: None)
+        retries - How many times to retry a call that failed for a
+                  transient reason (default: 0)
+        retry_backoff - Base delay in seconds before the first retry, each
+                        retry waits up to twice as long, with jitter
+                        (default: 0.5)
+        retry_errorcodes - ApiError codes that mean the API is pushing back
+                           and the call may be retried (default: none)
+        hedge - Send a duplicate of a read that is slower than usual and use
+                whichever answer arrives first, the copies are sent from a
+                pool of 2 * max_workers threads (default: False)
+        hedge_percentile - Percentile of the recent latencies of an action
+                           after which its duplicate goes out (default: 95)
+        hedge_delay - Delay before the duplicate goes out while there are too
+                      few latencies to go by, in seconds (default: 1.0)
+        singleflight - Share one request between identical reads made at
+                       the same time, and send identical reads queued in a
+                       batch only once; the callers then share one result
+                       object (default: False)
+        collect_stats - Time every request, see stats() (default: False)
+        stats_hook - Called after every request with its action and a
+                     dictionary of its timings, sizes and error, for feeding
+                     a metrics system; implies collect_stats (default: None)
+        span_exporter - Object with an export(span) method that is handed
+                        a Span for every request; batch requests have a
+                        child span for each call (default: None)
+        json_backend - JSON library to decode responses with, one of
+                       json_backends() (default: the fastest one that
+                       handles numbers as asked)
+        numbers - How to decode numbers with a fraction: 'decimal' for
+                  exact Decimals, 'float', or 'lazy' for LazyNumbers, kept as
+                  text and decoded when used (default: 'decimal')
+        records - Return the rows of methods with returns metadata as
+                  Record objects, which hold their fields in slots and take
+                  far less memory than dictionaries (default: False)
+
+  Reads (avail.*, *.list and test.echo) are retried on HTTP 5xx and
+  connection errors.  Any call is retried when the API turns it away, that
+  is HTTP 429 or 503 or one of retry_errorcodes, which also slows down the
+  rate limits involved.
 
   This interfaces with the Linode API (version 2) and receives a response
   via JSON, which is then parsed and returned as a dictionary (or list
@@ -205,12 +1406,74 @@ class Api:
         http://www.linode.com/api/
   """
 
-  def __init__(self, key=None, batching=False):
+  # False in subclasses that cannot stream responses, which rules out the
+  # iter_ methods and fields=
+  _streaming = True
+
+  def __init__(self, key=None, batching=False, pool=None, max_workers=8,
+               autobatch=False, batch_size=25, batch_window=0.05,
+               rate_limit=None, action_limits=None, retries=0,
+               retry_backoff=0.5, retry_errorcodes=(), hedge=False,
+               hedge_percentile=95, hedge_delay=1.0, singleflight=False,
+               collect_stats=False, stats_hook=None, span_exporter=None,
+               json_backend=None, numbers='decimal', records=False):
     self.__key = key
+    if TRANSPORT is None:
+      load_transport()
     self.__urlopen = URLOPEN
     self.__request = URLREQUEST
+    if pool is None and URLPOOL is not None:
+      pool = URLPOOL()
+    self.__pool = pool
     self.batching = batching
     self.__batch_cache = []
+    self.max_workers = max_workers
+    self.__workers = None
+    self.__hedgers = None
+    self.__workers_lock = threading.Lock()
+    if autobatch and futures is None:
+      raise Exception('autobatch requires concurrent.futures, install the futures package')
+    self.autobatch = autobatch
+    self.batch_size = batch_size
+    self.batch_window = batch_window
+    self.__queue = []
+    self.__queue_timer = None
+    self.__queue_lock = threading.Lock()
+    self.__bucket = self.__make_bucket(rate_limit)
+    self.__action_buckets = {}
+    for action, limit in (action_limits or {}).items():
+      action = action.lower().replace('_', '.')
+      self.__action_buckets[action] = self.__make_bucket(limit)
+    self.retries = retries
+    self.retry_backoff = retry_backoff
+    self.retry_errorcodes = retry_errorcodes
+    if hedge and futures is None:
+      raise Exception('hedge requires concurrent.futures, install the futures package')
+    self.hedge = hedge
+    self.hedge_percentile = hedge_percentile
+    self.hedge_delay = hedge_delay
+    self.__latencies = {}
+    self.singleflight = singleflight
+    self.__flights = {}
+    self.__flights_lock = threading.Lock()
+    self.collect_stats = collect_stats or stats_hook is not None
+    self.stats_hook = stats_hook
+    self.__stats = {}
+    self.__stats_lock = threading.Lock()
+    self.span_exporter = span_exporter
+    self.numbers = numbers
+    self.records = records
+    self.json_backend, self.__loads, self.__loads_bytes = \
+      json_decoder(json_backend, numbers)
+    # the iter_ methods need raw_decode, which only the json module offers
+    self.__stream_decoder = json.JSONDecoder(parse_float={
+      'decimal': Decimal, 'lazy': LazyNumber}.get(numbers, float))
+
+  @staticmethod
+  def __make_bucket(limit):
+    if limit is None or isinstance(limit, TokenBucket):
+      return limit
+    return TokenBucket(limit)
 
   @staticmethod
   def valid_commands():
@@ -222,15 +1485,296 @@ class Api:
     """Returns a list of all parameters used by methods of this class."""
     return list(ApiInfo.valid_params.keys())
 
+  def stats(self):
+    """Returns the request statistics gathered with collect_stats.
+
+    Returns dictionary of actions (batch requests count as 'batch'):
+        {'linode.list': {
+          'requests'      : number of requests sent,
+          'errors'        : number of them that failed,
+          'build'         : seconds spent adding authentication and headers,
+          'encode'        : seconds spent urlencoding the request,
+          'network'       : seconds spent sending it and reading the answer,
+          'decode'        : seconds spent decoding the JSON,
+          'wrap'          : seconds spent unwrapping the result,
+          'request_bytes' : size of the request body,
+          'response_bytes': size of the response body,
+        }, ...}
+
+    Each measurement is a dictionary of count, mean, min, max, p50, p90
+    and p99, the percentiles cover the last 1024 requests.
+    """
+    result = {}
+    with self.__stats_lock:
+      for action, stats in self.__stats.items():
+        summary = {'requests': stats['requests'], 'errors': stats['errors']}
+        for k, v in stats.items():
+          if isinstance(v, _Histogram) and v.count:
+            summary[k] = v.summary()
+        result[action] = summary
+    return result
+
+  def reset_stats(self):
+    """Forgets all request statistics."""
+    with self.__stats_lock:
+      self.__stats = {}
+
+  def __record(self, action, sample):
+    with self.__stats_lock:
+      stats = self.__stats.get(action)
+      if stats is None:
+        stats = self.__stats[action] = {'requests': 0, 'errors': 0}
+        for k in PHASES + ('request_bytes', 'response_bytes'):
+          stats[k] = _Histogram()
+      stats['requests'] += 1
+      if sample['error'] is not None:
+        stats['errors'] += 1
+      for k, v in sample.items():
+        if k in stats and v is not None and k not in ('requests', 'errors'):
+          stats[k].add(v)
+    if self.stats_hook is not None:
+      self.stats_hook(action, sample)
+
+  def key_digest(self):
+    """Returns the SHA-256 hex digest of the API key, which tells the data
+    of accounts apart without keeping the key itself."""
+    import hashlib
+    return hashlib.sha256((self.__key or '').encode('utf-8')).hexdigest()
+
   def batchFlush(self):
-    """Initiates a batch flush.  Raises Exception if not in batching mode."""
+    """Initiates a batch flush.  Raises Exception if not in batching mode.
+
+    A batch of more than batch_size calls is sent in several chunks.  If
+    some of them fail, raises BatchError holding the responses of the rest.
+
+    With autobatch enabled this sends any queued calls straight away and
+    waits for them, their results are delivered through their futures.
+    """
+    if self.autobatch:
+      self.__send_queue(self.__take_queue())
+      return
+
     if not self.batching:
       raise Exception('Cannot flush requests when not batching')
 
-    s = json.dumps(self.__batch_cache)
-    self.__batch_cache = []
-    request = { 'api_action' : 'batch', 'api_requestArray' : s }
-    return self.__send_request(request)
+    batch, self.__batch_cache = self.__batch_cache, []
+    return self.__send_batch(batch)
+
+  def __send_batch(self, requests):
+    """Sends requests in batches of at most batch_size, concurrently when
+    there is more than one, and returns all the responses in order"""
+    if self.singleflight:
+      # send each distinct read once, and hand its response to every copy
+      unique = []
+      positions = []
+      seen = {}
+      for r in requests:
+        if is_read_action(r['api_action']):
+          key = self.__request_key(r)
+          if key not in seen:
+            seen[key] = len(unique)
+            unique.append(r)
+          positions.append(seen[key])
+        else:
+          positions.append(len(unique))
+          unique.append(r)
+      if len(unique) < len(requests):
+        try:
+          results = self.__send_batch_chunks(unique)
+        except BatchError as ex:
+          raise BatchError(ex.errors, [ex.results[i] for i in positions])
+        return [results[i] for i in positions]
+    return self.__send_batch_chunks(requests)
+
+  def __send_batch_chunks(self, requests):
+    chunks = [requests[i:i + self.batch_size]
+              for i in range(0, len(requests), self.batch_size)]
+
+    def send(chunk):
+      s = json.dumps(chunk)
+      request = { 'api_action' : 'batch', 'api_requestArray' : s }
+      return self.__send_request(request, [r['api_action'] for r in chunk])
+
+    if len(chunks) == 1:
+      return send(chunks[0])
+
+    def attempt(chunk):
+      # a failed chunk must not hide the answers of the others, which may
+      # hold writes that went through
+      try:
+        return send(chunk)
+      except Exception as ex:
+        return ex
+
+    if (hasattr(self.__pool, 'open_many') and not self.collect_stats and
+        self.span_exporter is None):
+      outcomes = self.__send_many(chunks)
+    elif futures is not None:
+      outcomes = self.__executor().map(attempt, chunks)
+    else:
+      outcomes = [attempt(chunk) for chunk in chunks]
+    return _join_chunks(chunks, outcomes)
+
+  def __send_many(self, chunks):
+    """Sends the chunks of a batch at once through the open_many of the
+    pool, such as the multi handle of CurlPool, and returns the responses
+    or the exception of each chunk.  A chunk that may be retried is sent
+    again the usual way."""
+    actions = [[r['api_action'] for r in chunk] for chunk in chunks]
+    buckets = [self.__throttle(a) for a in actions]
+    prepared = []
+    for chunk in chunks:
+      request, headers = self._prepare_request(
+        { 'api_action' : 'batch', 'api_requestArray' : json.dumps(chunk) })
+      prepared.append(self.__request(LINODE_API_URL, urlencode(request), headers))
+
+    outcomes = [None] * len(chunks)
+    for i, response in self.__pool.open_many(prepared):
+      if isinstance(response, Exception):
+        outcomes[i] = response
+        continue
+      try:
+        outcomes[i] = self.__unwrap(self._decode_response(response.read()))
+      except Exception as ex:
+        outcomes[i] = ex
+
+    for i, outcome in enumerate(outcomes):
+      if not isinstance(outcome, Exception):
+        for b in buckets[i]:
+          b.speed_up()
+        continue
+      read = all(is_read_action(a) for a in actions[i])
+      if not self.__may_retry(outcome, read, 0, buckets[i]):
+        continue
+      self.__wait_to_retry('batch', 0, outcome)
+      request = { 'api_action' : 'batch', 'api_requestArray' : json.dumps(chunks[i]) }
+      try:
+        outcomes[i] = self.__send_retrying(request, actions[i], read, 1)
+      except Exception as ex:
+        outcomes[i] = ex
+    return outcomes
+
+  def submit(self, action, **params):
+    """Sends an API call from a worker thread, returns a Future for its result.
+
+    action is the method name, e.g. 'linode_disk_list' or 'linode.disk.list'.
+    Arguments are checked straight away, the call itself is never batched.
+    Requires concurrent.futures (the futures package on Python 2).
+    """
+    request = self.__build_request(action, params)
+    return self.__executor().submit(self.__send_request, request)
+
+  def map(self, action, iterable, max_workers=None):
+    """Calls action once for each dict of parameters in iterable, yielding
+    the results in order as they become available.
+
+    The calls run on the thread pool used by submit(), or on a pool of their
+    own when max_workers is given, with at most that many in flight at once.
+    Raises the ApiError of a failed call when its result is reached.
+    """
+    if max_workers is None:
+      executor = self.__executor()
+      window = self.max_workers
+    else:
+      executor = self.__new_executor(max_workers)
+      window = max_workers
+
+    pending = deque()
+    try:
+      for params in iterable:
+        request = self.__build_request(action, params)
+        pending.append(executor.submit(self.__send_request, request))
+        if len(pending) >= window:
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+    finally:
+      for f in pending:
+        f.cancel()
+      if max_workers is not None:
+        executor.shutdown(wait=False)
+
+  def __new_executor(self, max_workers):
+    if futures is None:
+      raise Exception('concurrent.futures is required, install the futures package')
+    return futures.ThreadPoolExecutor(max_workers)
+
+  def __executor(self):
+    with self.__workers_lock:
+      if self.__workers is None:
+        self.__workers = self.__new_executor(self.max_workers)
+      return self.__workers
+
+  def __build_request(self, action, params):
+    """Returns the checked request for an API call without sending it"""
+    name = action.replace('.', '_')
+    if name in ApiInfo.request_builders:
+      return ApiInfo.request_builders[name](self, params)
+    request = LowerCaseDict(params)
+    request['api_action'] = name.replace('_', '.')
+    return request
+
+  def __dispatch(self, request):
+    """Sends, batches or queues a request depending on the batching mode"""
+    if self.autobatch:
+      return self.__enqueue(request)
+    elif self.batching:
+      self.__batch_cache.append(request)
+      log.debug('Batched: %s', Redacted(request))
+    else:
+      return self.__send_request(request)
+
+  def __enqueue(self, request):
+    future = futures.Future()
+    batch = None
+    with self.__queue_lock:
+      self.__queue.append((request, future))
+      if len(self.__queue) >= self.batch_size:
+        batch = self.__take_queue(locked=True)
+      elif self.__queue_timer is None:
+        self.__queue_timer = threading.Timer(self.batch_window, self.__flush_queue)
+        self.__queue_timer.daemon = True
+        self.__queue_timer.start()
+    if batch:
+      self.__executor().submit(self.__send_queue, batch)
+    return future
+
+  def __take_queue(self, locked=False):
+    if not locked:
+      with self.__queue_lock:
+        return self.__take_queue(locked=True)
+    batch, self.__queue = self.__queue, []
+    if self.__queue_timer is not None:
+      self.__queue_timer.cancel()
+      self.__queue_timer = None
+    return batch
+
+  def __flush_queue(self):
+    self.__send_queue(self.__take_queue())
+
+  def __send_queue(self, batch):
+    batch = [(r, f) for r, f in batch if f.set_running_or_notify_cancel()]
+    if not batch:
+      return
+
+    try:
+      results = self.__send_batch([r for r, f in batch])
+    except BatchError as ex:
+      # only the calls of the chunks that failed get the error
+      results = ex.results
+    except Exception as ex:
+      for r, f in batch:
+        f.set_exception(ex)
+      return
+
+    for (r, f), result in zip(batch, results):
+      if isinstance(result, Exception):
+        f.set_exception(result)
+        continue
+      try:
+        f.set_result(self.__unwrap_response(result))
+      except Exception as ex:
+        f.set_exception(ex)
 
   def __getattr__(self, name):
     """Return a callable for any undefined attribute and assume it's an API call"""
@@ -241,16 +1785,283 @@ class Api:
       request = LowerCaseDict(kw)
       request['api_action'] = name.replace('_', '.')
 
-      if self.batching:
-        self.__batch_cache.append(request)
-        logging.debug('Batched: %s', json.dumps(request))
-      else:
-        return self.__send_request(request)
+      return self.__dispatch(request)
 
     generic_request.__name__ = name
     return generic_request
 
-  def __send_request(self, request):
+  def __send_request(self, request, actions=None):
+    """Sends a request under the rate limits, retrying transient failures.
+    actions lists the calls inside a batch request."""
+    if actions is None:
+      actions = [request['api_action']]
+    read = all(is_read_action(a) for a in actions)
+
+    if self.singleflight and read and request['api_action'] != 'batch':
+      key = self.__request_key(request)
+      with self.__flights_lock:
+        flight = self.__flights.get(key)
+        leader = flight is None
+        if leader:
+          flight = self.__flights[key] = _Flight()
+      if not leader:
+        return flight.wait()
+      try:
+        flight.result = self.__send_retrying(request, actions, read)
+      except Exception as ex:
+        flight.error = ex
+        raise
+      finally:
+        with self.__flights_lock:
+          del self.__flights[key]
+        flight.done.set()
+      return flight.result
+
+    return self.__send_retrying(request, actions, read)
+
+  @staticmethod
+  def __request_key(request):
+    """Returns a key identifying the action and parameters of a request"""
+    return tuple(sorted((k.lower(), str(v)) for k,v in request.items()
+                        if k.lower() not in ('api_key', 'api_responseformat')))
+
+  def __send_retrying(self, request, actions, read, attempt=0):
+    while True:
+      buckets = self.__throttle(actions)
+      try:
+        if self.hedge and read:
+          result = self.__send_hedged(request)
+        else:
+          result = self.__send_once(request)
+      except Exception as ex:
+        if not self.__may_retry(ex, read, attempt, buckets):
+          raise
+        self.__wait_to_retry(request['api_action'], attempt, ex)
+        attempt += 1
+      else:
+        for b in buckets:
+          b.speed_up()
+        return result
+
+  def __may_retry(self, ex, read, attempt, buckets):
+    """Returns True if a call that failed with ex may be sent again, slowing
+    down its rate limits if the API pushed back"""
+    pushback = self.__is_pushback(ex)
+    if pushback:
+      for b in buckets:
+        b.slow_down()
+    return attempt < self.retries and (pushback or
+                                       (read and self.__is_transient(ex)))
+
+  def __wait_to_retry(self, action, attempt, ex):
+    delay = random.uniform(0, min(30, self.retry_backoff * 2 ** attempt))
+    log.debug('Retrying %s in %.2fs after %r', action, delay, ex)
+    time.sleep(delay)
+
+  def __throttle(self, actions):
+    """Waits for the rate limits of actions, returns the buckets involved"""
+    buckets = []
+    if self.__bucket is not None:
+      self.__bucket.acquire(len(actions))
+      buckets.append(self.__bucket)
+    if self.__action_buckets:
+      counts = {}
+      for a in actions:
+        a = a.lower()
+        if a in self.__action_buckets:
+          counts[a] = counts.get(a, 0) + 1
+      for a, n in counts.items():
+        self.__action_buckets[a].acquire(n)
+        buckets.append(self.__action_buckets[a])
+    return buckets
+
+  def __send_hedged(self, request):
+    """Sends a read, and a duplicate of it if the first is slow to answer.
+    Returns the first successful answer."""
+    action = request['api_action']
+    latencies = self.__latencies.setdefault(action, deque(maxlen=100))
+    if len(latencies) >= 10:
+      delay = _percentile(latencies, self.hedge_percentile)
+    else:
+      delay = self.hedge_delay
+
+    def attempt(duplicate):
+      if duplicate:
+        # the duplicate is a call of its own as far as the limits go
+        self.__throttle([action])
+      return self.__send_once(copy.copy(request)), time.time()
+
+    executor = self.__hedge_executor()
+    started = time.time()
+    pending = [executor.submit(attempt, False)]
+    if not futures.wait(pending, timeout=delay)[0]:
+      log.debug('Hedging %s after %.3fs', action, delay)
+      pending.append(executor.submit(attempt, True))
+
+    error = None
+    while pending:
+      done = futures.wait(pending, return_when=futures.FIRST_COMPLETED)[0]
+      for f in done:
+        pending.remove(f)
+        try:
+          value, finished = f.result()
+        except Exception as ex:
+          # the other copy may still succeed
+          error = error or ex
+          continue
+        for other in pending:
+          other.cancel()
+        # from the first send, whichever copy answered
+        latencies.append(finished - started)
+        return value
+    raise error
+
+  def __hedge_executor(self):
+    # a pool of its own, as a read sent from a worker of the submit() and
+    # map() pool must not wait for a free worker of that pool
+    with self.__workers_lock:
+      if self.__hedgers is None:
+        self.__hedgers = self.__new_executor(2 * self.max_workers)
+      return self.__hedgers
+
+  def __is_pushback(self, ex):
+    if isinstance(ex, ApiError):
+      return ex.value[0]['ERRORCODE'] in self.retry_errorcodes
+    return _http_status(ex) in (429, 503)
+
+  def __is_transient(self, ex):
+    status = _http_status(ex)
+    if status is not None:
+      return status >= 500
+    return isinstance(ex, TRANSPORT_ERRORS)
+
+  def __send_once(self, request):
+    if not self.collect_stats and self.span_exporter is None:
+      request, headers = self._prepare_request(request)
+      body = urlencode(request)
+      response = self.__open(body, headers)
+      return self.__unwrap(self._decode_response(response))
+
+    sample = dict([(k, None) for k in PHASES + ('request_bytes', 'response_bytes')])
+    sample['error'] = None
+    action = request['api_action']
+    began = time.time()
+    s = None
+    try:
+      started = _clock()
+      request, headers = self._prepare_request(request)
+      sample['build'] = _clock() - started
+
+      started = _clock()
+      body = urlencode(request)
+      sample['encode'] = _clock() - started
+      sample['request_bytes'] = len(body)
+
+      started = _clock()
+      response = self.__open(body, headers)
+      sample['network'] = _clock() - started
+      sample['response_bytes'] = _body_bytes(response)
+
+      started = _clock()
+      s = self._decode_response(response)
+      sample['decode'] = _clock() - started
+
+      started = _clock()
+      try:
+        return self.__unwrap(s)
+      finally:
+        sample['wrap'] = _clock() - started
+    except Exception as ex:
+      sample['error'] = ex
+      raise
+    finally:
+      if self.collect_stats:
+        self.__record(action, sample)
+      if self.span_exporter is not None:
+        self.__export_span(request, sample, s, began)
+
+  def __export_span(self, request, sample, response, began):
+    attributes = dict([(k, v) for k,v in sample.items() if k != 'error'])
+    attributes['action'] = request['api_action']
+    span = Span(request['api_action'], began, attributes)
+
+    if request['api_action'] == 'batch':
+      calls = json.loads(request['api_requestArray'])
+      attributes['calls'] = len(calls)
+      if not isinstance(response, list):
+        response = [None] * len(calls)
+      for call, result in zip(calls, response):
+        params = Redacted.redact(call)
+        name = params.pop('api_action')
+        child = span.child(name, {'action': name, 'params': params})
+        if result is None:
+          continue
+        # the size of the response is known for the whole batch only
+        errors = LowerCaseDict(result).get('ERRORARRAY') or []
+        child.attributes['success'] = not (errors and errors[0]['ERRORCODE'] != 0)
+        if not child.attributes['success']:
+          child.error = ApiError(errors)
+
+    span.finish(time.time(), sample['error'])
+    self.span_exporter.export(span)
+
+  def _stream(self, request, fields=None):
+    """Sends request straight away, yielding the elements of its DATA as
+    they are decoded.  Raises ApiError if the response holds an error.
+
+    Given fields, the rows only keep those fields (in any case), the rest
+    is dropped as soon as each row is decoded.  Requests with fields skip
+    batching, retries and hedging.
+    """
+    action = request['api_action']
+    self.__throttle([action])
+    request, headers = self._prepare_request(request)
+    stream = _JsonStream(self.__open_stream(urlencode(request), headers),
+                         self.__stream_decoder)
+    try:
+      stream.expect('{')
+      if stream.peek() == '}':
+        return
+      while True:
+        key = stream.value().upper()
+        stream.expect(':')
+        if key == 'DATA' and stream.peek() == '[':
+          rows = stream.array()
+          if fields is not None:
+            rows = _project(rows, fields)
+          cls = self.records and _record_class(action)
+          if cls:
+            rows = (cls.from_row(r) if isinstance(r, dict) else r for r in rows)
+          for row in rows:
+            yield row
+        else:
+          value = stream.value()
+          if key == 'ERRORARRAY' and value and value[0]['ERRORCODE'] != 0:
+            raise ApiError(value)
+        if stream.expect(',}') == '}':
+          return
+    finally:
+      stream.close()
+
+  def __open_stream(self, body, headers):
+    req = self.__request(LINODE_API_URL, body, headers)
+    if self.__pool is None:
+      response = self.__urlopen(req)
+      return iter(lambda: response.read(STREAM_CHUNK), b'')
+    if hasattr(self.__pool, 'stream'):
+      return self.__pool.stream(req)
+    return [self.__pool.open(req).read()]
+
+  def __open(self, body, headers):
+    req = self.__request(LINODE_API_URL, body, headers)
+    if self.__pool is not None:
+      response = self.__pool.open(req)
+    else:
+      response = self.__urlopen(req)
+    return response.read()
+
+  def _prepare_request(self, request):
+    """Adds authentication to a request, returns it with the headers to send"""
     if self.__key:
       request['api_key'] = self.__key
     elif request['api_action'] != 'user.getapikey':
@@ -258,47 +2069,60 @@ class Api:
 
     request['api_responseFormat'] = 'json'
 
-    request_log = copy.deepcopy(request)
-    redact = ['api_key','rootsshkey','rootpass']
-    for r in redact:
-        if r in request_log:
-            request_log[r] = '{0}: xxxx REDACTED xxxx'.format(r)
-
-    logging.debug('Parameters '+str(request_log))
+    if log.isEnabledFor(logging.DEBUG):
+      log.debug('Parameters %s', Redacted(request),
+                extra={'api_action': request['api_action']})
     #request = urllib.urlencode(request)
 
     headers = {
       'User-Agent': 'LinodePython/'+VERSION,
     }
 
-    req = self.__request(LINODE_API_URL, request, headers)
-    response = self.__urlopen(req)
-    response = response.read()
+    return request, headers
 
-    logging.debug('Raw Response: '+response)
+  def _columns(self, rows, kind):
+    """Turns the rows of a list call into columns=kind"""
+    return _columnar(rows, kind)
 
-    if FULL_BODIED_JSON:
-      try:
-        s = json.loads(response, parse_float=Decimal)
-      except Exception as ex:
-        print(response)
-        raise ex
-    else:
-      # Stuck with simplejson, which won't let us parse_float
-      s = json.loads(response)
+  def _parse_response(self, response):
+    """Decodes a raw API response, raising ApiError if it holds an error"""
+    return self.__unwrap(self._decode_response(response))
 
+  def _decode_response(self, response):
+    """Decodes the JSON of a raw API response"""
+    if (not self.__loads_bytes and isinstance(response, bytes) and
+        not isinstance(response, str)):
+      # Python 3 transports hand back bytes
+      response = response.decode('utf-8')
+
+    if log.isEnabledFor(logging.DEBUG):
+      log.debug('Raw Response: %s', response)
+
+    try:
+      return self.__loads(response)
+    except Exception as ex:
+      print(response)
+      raise ex
+
+  def __unwrap(self, s):
     if isinstance(s, dict):
-      s = LowerCaseDict(s)
-      if len(s['ERRORARRAY']) > 0:
-        if s['ERRORARRAY'][0]['ERRORCODE'] is not 0:
-          raise ApiError(s['ERRORARRAY'])
-      if s['ACTION'] == 'user.getapikey':
-        self.__key = s['DATA']['API_KEY']
-        logging.debug('API key is: '+self.__key)
-      return s['DATA']
+      return self.__unwrap_response(s)
     else:
       return s
 
+  def __unwrap_response(self, s):
+    """Returns the DATA of a single response, raising ApiError on errors"""
+    s = LowerCaseDict(s)
+    if len(s['ERRORARRAY']) > 0:
+      if s['ERRORARRAY'][0]['ERRORCODE'] != 0:
+        raise ApiError(s['ERRORARRAY'])
+    if s['ACTION'] == 'user.getapikey':
+      self.__key = s['DATA']['API_KEY']
+      log.debug('API key is: %s', self.__key)
+    if self.records:
+      return _as_records(s['ACTION'], s['DATA'])
+    return s['DATA']
+
   def __api_request(required=[], optional=[], returns=[]):
     """Decorator to define required and optional parameters"""
     for k in required:
@@ -315,7 +2139,7 @@ class Api:
       if func.__name__ not in ApiInfo.valid_commands:
         ApiInfo.valid_commands[func.__name__] = True
 
-      def wrapper(self, **kw):
+      def build(self, kw):
         request = LowerCaseDict()
         request['api_action'] = func.__name__.replace('_', '.')
 
@@ -333,42 +2157,38 @@ class Api:
         if result is not None:
           request = result
 
-        if self.batching:
-          self.__batch_cache.append(request)
-          logging.debug('Batched: '+ json.dumps(request))
-        else:
-          return self.__send_request(request)
+        return request
+
+      ApiInfo.request_builders[func.__name__] = build
+      ApiInfo.methods[func.__name__] = (required, optional, returns)
+
+      # only reads returning rows stream, methods that declare no result
+      # aren't lists whatever the default, and writes are sent as they are
+      streams = bool(isinstance(returns, list) and returns and
+                     is_read_action(func.__name__))
+      if streams:
+        ApiInfo.list_commands[func.__name__] = True
+
+        def wrapper(self, fields=None, columns=False, **kw):
+          if fields is not None and not self._streaming:
+            raise Exception('%s cannot stream, call %s() without fields'
+                            % (self.__class__.__name__, func.__name__))
+          if columns:
+            if fields is None:
+              return self._columns(self.__send_request(build(self, kw)), columns)
+            return _columnar(self._stream(build(self, kw), fields), columns)
+          if fields is not None:
+            return list(self._stream(build(self, kw), fields))
+          return self.__dispatch(build(self, kw))
+      else:
+        def wrapper(self, **kw):
+          return self.__dispatch(build(self, kw))
 
       wrapper.__name__ = func.__name__
-      wrapper.__doc__ = func.__doc__
       wrapper.__dict__.update(func.__dict__)
-
-      if (required or optional) and wrapper.__doc__:
-        # Generate parameter documentation in docstring
-        if len(wrapper.__doc__.split('\n')) is 1:  # one-liners need whitespace
-          wrapper.__doc__ += '\n'
-        wrapper.__doc__ += '\n    Keyword arguments (* = required):\n'
-        wrapper.__doc__ += ''.join(['\t *%s\n' % p for p in required])
-        wrapper.__doc__ += ''.join(['\t  %s\n' % p for p in optional])
-
-      if returns and wrapper.__doc__:
-        # we either have a list of dicts or a just plain dict
-        if len(wrapper.__doc__.split('\n')) is 1:  # one-liners need whitespace
-          wrapper.__doc__ += '\n'
-        if isinstance(returns, list):
-          width = max(len(q) for q in returns[0].keys())
-          wrapper.__doc__ += '\n    Returns list of dictionaries:\n\t[{\n'
-          wrapper.__doc__ += ''.join(['\t  %-*s: %s\n'
-                              % (width, p, returns[0][p]) for p in returns[0].keys()])
-          wrapper.__doc__ += '\t }, ...]\n'
-        else:
-          width = max(len(q) for q in returns.keys())
-          wrapper.__doc__ += '\n    Returns dictionary:\n\t {\n'
-          wrapper.__doc__ += ''.join(['\t  %-*s: %s\n'
-                              % (width, p, returns[p]) for p in returns.keys()])
-          wrapper.__doc__ += '\t }\n'
-
-      return wrapper
+      # the docstring is written from this when first read
+      return _ApiMethod(wrapper, func.__doc__, required, optional, returns,
+                        streams)
     return decorator
 
   @__api_request(optional=['LinodeID'],
@@ -1044,3 +2864,22 @@ class Api:
     """
     pass
 
+def _iter_method(name):
+  build = ApiInfo.request_builders[name]
+
+  def iterate(self, fields=None, **kw):
+    if not self._streaming:
+      raise Exception('%s cannot stream, call %s() instead'
+                      % (self.__class__.__name__, name))
+    return self._stream(build(self, kw), fields)
+
+  iterate.__name__ = 'iter_' + name
+  iterate.__doc__ = """Same as %s(), but yields the rows of the result
+    one at a time as they arrive, without holding the whole response in
+    memory.  The request is sent straight away, even when batching.
+    fields=[...] keeps only those fields of each row.
+    """ % name
+  return iterate
+
+for _name in ApiInfo.list_commands:
+  setattr(Api, 'iter_' + _name, _iter_method(_name))
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# vim:ts=2:sw=2:expandtab
+"""
+Micro-benchmarks for the hot paths of api.py.
+
+Run all of them with: python bench.py
+or only some with:    python bench.py logging ...
+
+This code is provided under an MIT-style license. Please refer to the LICENSE
+file in the root of the project for specifics.
+"""
+
+import copy
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+import api
+import oop
+
+BENCHMARKS = {}
+
+def benchmark(func):
+  BENCHMARKS[func.__name__] = func
+  return func
+
+def report(label, func, number):
+  best = min(timeit.repeat(func, number=number, repeat=3))
+  print('  %-44s %12.2f us/call' % (label, best / number * 1e6))
+
+def linode_rows(count):
+  rows = []
+  for i in range(count):
+    rows.append({'LINODEID': i, 'LABEL': 'web-%04d' % i, 'STATUS': 1,
+                 'DATACENTERID': 2 + i % 6, 'PLANID': 1, 'TOTALRAM': 1024,
+                 'TOTALHD': 24576, 'TOTALXFER': 2000, 'WATCHDOG': 1,
+                 'LPM_DISPLAYGROUP': 'group-%d' % (i % 10),
+                 'BACKUPSENABLED': 0, 'BACKUPWINDOW': 0, 'BACKUPWEEKLYDAY': 0,
+                 'ALERT_CPU_ENABLED': 1, 'ALERT_CPU_THRESHOLD': 90,
+                 'ALERT_DISKIO_ENABLED': 1, 'ALERT_DISKIO_THRESHOLD': 1000,
+                 'ALERT_BWIN_ENABLED': 1, 'ALERT_BWIN_THRESHOLD': 5,
+                 'ALERT_BWOUT_ENABLED': 1, 'ALERT_BWOUT_THRESHOLD': 5,
+                 'ALERT_BWQUOTA_ENABLED': 1, 'ALERT_BWQUOTA_THRESHOLD': 80})
+  return rows
+
+def linode_list_response(count):
+  return json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                     'DATA': linode_rows(count)})
+
+@benchmark
+def logging():
+  """Per call cost of request/response logging with DEBUG disabled"""
+  def eager(request, response):
+    # what __send_request did before logging went lazy
+    request_log = copy.deepcopy(request)
+    for r in ['api_key','rootsshkey','rootpass']:
+      if r in request_log:
+        request_log[r] = '{0}: xxxx REDACTED xxxx'.format(r)
+    api.log.debug('Parameters '+str(request_log))
+    api.log.debug('Raw Response: '+response)
+
+  def lazy(request, response):
+    if api.log.isEnabledFor(api.logging.DEBUG):
+      api.log.debug('Parameters %s', api.Redacted(request))
+    if api.log.isEnabledFor(api.logging.DEBUG):
+      api.log.debug('Raw Response: %s', response)
+
+  api.log.setLevel(api.logging.WARNING)
+  request = api.LowerCaseDict({'api_action': 'domain.resource.list',
+                               'api_key': 'x' * 64, 'DomainID': 1234,
+                               'api_responseFormat': 'json'})
+  for count in (10, 5000):
+    response = linode_list_response(count)
+    print('%d row response (%d bytes)' % (count, len(response)))
+    report('eager deepcopy and concatenation', lambda: eager(request, response), 2000)
+    report('lazy', lambda: lazy(request, response), 2000)
+
+class LegacyLowerCaseDict(dict):
+  # LowerCaseDict as it was before keys were shared between instances
+  def __init__(self, copy=None):
+    if copy:
+      if isinstance(copy, dict):
+        for k,v in copy.items():
+          dict.__setitem__(self, k.lower(), v)
+      else:
+        for k,v in copy:
+          dict.__setitem__(self, k.lower(), v)
+
+  def __getitem__(self, key):
+    return dict.__getitem__(self, key.lower())
+
+  def __setitem__(self, key, value):
+    dict.__setitem__(self, key.lower(), value)
+
+  def __contains__(self, key):
+    return dict.__contains__(self, key.lower())
+
+  def get(self, key, def_val=None):
+    return dict.get(self, key.lower(), def_val)
+
+def instance_bytes(cls, rows):
+  """Average memory held by one instance built from each of rows"""
+  try:
+    import tracemalloc
+  except ImportError:
+    # Python 2, count the object and its key strings
+    objs = [cls(r) for r in rows]
+    total = sum(sys.getsizeof(o) for o in objs)
+    seen = set()
+    for o in objs:
+      for k in dict.keys(o):
+        if id(k) not in seen:
+          seen.add(id(k))
+          total += sys.getsizeof(k)
+    return total / len(rows)
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  objs = [cls(r) for r in rows]
+  total = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  return total / len(rows)
+
+@benchmark
+def lowercasedict():
+  """LowerCaseDict against the implementation it replaced"""
+  row = json.loads(linode_list_response(1))['DATA'][0]
+  rows = json.loads(linode_list_response(2000))['DATA']
+  for cls in (LegacyLowerCaseDict, api.LowerCaseDict):
+    d = cls(row)
+    print(cls.__name__)
+    report('construct from a linode.list row', lambda: cls(row), 20000)
+    report('d[key]', lambda: d['TOTALRAM'], 200000)
+    report('key in d', lambda: 'TOTALRAM' in d, 200000)
+    report('d.get(key)', lambda: d.get('LPM_DISPLAYGROUP'), 200000)
+    print('  %-44s %12d bytes' % ('memory per row', instance_bytes(cls, rows)))
+
+def plans_response(count):
+  # avail.linodeplans style rows, mostly numbers with a fraction
+  data = []
+  for i in range(count):
+    data.append({'PLANID': i, 'LABEL': 'Linode %d' % (i * 1024),
+                 'PRICE': 10.0 * (i + 1) + 0.01 * i, 'HOURLY': 0.015 * (i + 1),
+                 'RAM': 1024 * (i + 1), 'DISK': 24 * (i + 1), 'XFER': 2000,
+                 'CORES': 1 + i % 8, 'AVAIL': {'2': 500, '3': 500, '4': 500}})
+  return json.dumps({'ERRORARRAY': [], 'ACTION': 'avail.linodeplans',
+                     'DATA': data})
+
+@benchmark
+def decode():
+  """Response decoding with each installed JSON backend and number mode"""
+  responses = [('linode.list, 2000 rows', linode_list_response(2000)),
+               ('avail.linodeplans, 2000 rows', plans_response(2000))]
+  for label, response in responses:
+    raw = response.encode('utf-8')
+    print('%s (%d bytes)' % (label, len(raw)))
+    for backend in reversed(api.json_backends()):
+      for numbers in api.NUMBER_MODES:
+        a = api.Api('x', json_backend=backend, numbers=numbers)
+        if a.json_backend != backend:
+          continue
+        report('%s, numbers=%s' % (backend, numbers),
+               lambda: a._decode_response(raw), 20)
+
+class BodyPool(object):
+  # a pool answering every request with the same body, without a network
+  def __init__(self, body):
+    self.body = body.encode('utf-8')
+
+  def open(self, request):
+    return self
+
+  def read(self):
+    return self.body
+
+  def stream(self, request):
+    for i in range(0, len(self.body), api.STREAM_CHUNK):
+      yield self.body[i:i + api.STREAM_CHUNK]
+
+def memory_bytes(func):
+  """Memory held by what func returns, and the most func used at once"""
+  try:
+    import tracemalloc
+  except ImportError:
+    # Python 2
+    return -1, -1
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  result = func()
+  held, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return held - before, peak - before
+
+@benchmark
+def projection():
+  """linode_list of 2000 rows, whole rows against fields=[...]"""
+  a = api.Api('x', pool=BodyPool(linode_list_response(2000)))
+  fields = ['LINODEID', 'LABEL', 'STATUS']
+  calls = [('whole rows', lambda: a.linode_list()),
+           ('fields=%s' % ','.join(fields), lambda: a.linode_list(fields=fields))]
+  for label, call in calls:
+    report(label, call, 10)
+    held, peak = memory_bytes(call)
+    if held < 0:
+      continue
+    print('  %-44s %12d bytes' % ('memory held by the result', held))
+    print('  %-44s %12d bytes' % ('peak memory', peak))
+
+@benchmark
+def records():
+  """linode_list of 5000 rows as dictionaries against Records"""
+  body = linode_list_response(5000)
+  for records in (False, True):
+    a = api.Api('x', pool=BodyPool(body), records=records)
+    report('records=%s' % records, lambda: a.linode_list(), 5)
+    held, peak = memory_bytes(lambda: a.linode_list())
+    if held < 0:
+      rows = a.linode_list()
+      held = sum(sys.getsizeof(r) for r in rows) + sys.getsizeof(rows)
+    print('  %-44s %12d bytes' % ('memory held by the result', held))
+
+@benchmark
+def columns():
+  """Total RAM per datacenter over 5000 Linodes, from rows and columns"""
+  a = api.Api('x', pool=BodyPool(linode_list_response(5000)))
+  rows = a.linode_list()
+  cols = a.linode_list(columns=True)
+  numpy = api._numpy()
+
+  def by_rows():
+    totals = {}
+    for r in rows:
+      dc = r['DATACENTERID']
+      totals[dc] = totals.get(dc, 0) + r['TOTALRAM']
+    return totals
+
+  def by_columns():
+    if numpy is not None:
+      return numpy.bincount(cols['DATACENTERID'], weights=cols['TOTALRAM'])
+    totals = {}
+    for dc, ram in zip(cols['DATACENTERID'], cols['TOTALRAM']):
+      totals[dc] = totals.get(dc, 0) + ram
+    return totals
+
+  report('linode_list()', lambda: a.linode_list(), 5)
+  report('linode_list(columns=True)', lambda: a.linode_list(columns=True), 5)
+  report('reduce over rows', by_rows, 50)
+  report('reduce over columns (numpy: %s)' % (numpy is not None),
+         by_columns, 50)
+  if memory_bytes(lambda: None)[0] < 0:
+    return
+  print('  %-44s %12d bytes' % ('memory held by rows', memory_bytes(a.linode_list)[0]))
+  print('  %-44s %12d bytes' % ('memory held by columns',
+                                memory_bytes(lambda: a.linode_list(columns=True))[0]))
+
+@benchmark
+def identity_map():
+  """Linode.get() through the API against from the identity map"""
+  oop.ActiveContext = api.Api('x', pool=BodyPool(linode_list_response(1)))
+  def uncached():
+    oop._id_cache.clear()
+    return oop.Linode.get(id=0)
+  report('through the API', uncached, 2000)
+  report('from the identity map', lambda: oop.Linode.get(id=0), 20000)
+
+  a = oop.ActiveContext = api.Api('x', pool=BodyPool(linode_list_response(5000)))
+  def scan():
+    for r in a.linode_list():
+      if r['LABEL'] == 'web-4200':
+        return r
+  list(oop.Linode.list())
+  print('Linode with label web-4200 among 5000')
+  report('scanning linode_list()', scan, 10)
+  report('Linode.get(label=...) from the index',
+         lambda: oop.Linode.get(label='web-4200'), 20000)
+  oop.ActiveContext = None
+
+@benchmark
+def refresh():
+  """Refreshing the Linode map from 5000 rows, rebuilt against synced"""
+  rows = linode_rows(5000)
+  cache = oop._cache(oop.Linode)
+
+  def rebuild():
+    # what fill_cache did before it synced
+    cache.clear()
+    for r in rows:
+      oop.Linode(r).cache_add()
+
+  changed = linode_rows(5000)
+  for r in changed[::100]:
+    r['STATUS'] = 2
+  report('rebuild', rebuild, 5)
+  cache.sync(oop.Linode, rows)
+  report('sync, nothing changed', lambda: cache.sync(oop.Linode, rows), 5)
+  versions = [changed, rows]
+  def flip():
+    versions.reverse()
+    cache.sync(oop.Linode, versions[0])
+  report('sync, 1% changed', flip, 6)
+  oop._id_cache.clear()
+
+@benchmark
+def snapshot():
+  """Warm start of 5000 Linodes from a saved snapshot against the API"""
+  import tempfile
+  a = oop.ActiveContext = api.Api('x', pool=BodyPool(linode_list_response(5000)))
+  path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+  list(oop.Linode.list())
+  report('save_cache', lambda: oop.save_cache(path, a), 5)
+
+  def from_api():
+    oop._id_cache.clear()
+    list(oop.Linode.list())
+  def from_snapshot():
+    oop._id_cache.clear()
+    oop.load_cache(path, a)
+  report('Linode.list(), without the network', from_api, 5)
+  report('load_cache', from_snapshot, 5)
+  print('  %-44s %12d bytes' % ('snapshot size', os.path.getsize(path)))
+  os.remove(path)
+  os.rmdir(os.path.dirname(path))
+  oop.ActiveContext = None
+  oop._id_cache.clear()
+
+IMPORT_STEPS = [
+  ('import api', 'import api'),
+  ('first Api()', 'api.Api("x")'),
+  ('every docstring', '[getattr(api.Api, n).__doc__ for n in api.ApiInfo.valid_commands]'),
+  ('every JSON backend', 'api.json_backends()'),
+]
+
+@benchmark
+def import_time():
+  """Cost of importing api in a fresh interpreter, and of what it defers"""
+  script = ['import time', 't = [time.time()]']
+  for label, code in IMPORT_STEPS:
+    script += [code, 't.append(time.time())']
+  script.append('print(" ".join([repr(b - a) for a, b in zip(t, t[1:])]))')
+  here = os.path.dirname(os.path.abspath(__file__))
+  runs = []
+  for i in range(5):
+    out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', '\n'.join(script)],
+                                  cwd=here)
+    runs.append([float(s) for s in out.decode('ascii').split()])
+  for i, (label, code) in enumerate(IMPORT_STEPS):
+    print('  %-44s %12.2f ms' % (label, min([r[i] for r in runs]) * 1e3))
+
+if __name__ == '__main__':
+  names = sys.argv[1:] or sorted(BENCHMARKS)
+  for name in names:
+    print('%s: %s' % (name, BENCHMARKS[name].__doc__))
+    BENCHMARKS[name]()
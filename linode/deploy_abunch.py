@@ -37,6 +37,7 @@ from getpass import getpass
 from os import environ, linesep
 
 import api
+import workflow
 
 parser = OptionParser()
 parser.add_option('-d', '--datacenter', dest="datacenter",
@@ -159,65 +160,48 @@ if re.search(r'\W', root_pass):
 if valid_pass < 2:
   sys.exit('Password too simple, only %d of 4 classes found' % (valid_pass))
 
-linode_api = api.Api(api_key, batching=True)
-
-needFlush = False
-
-created_linodes = []
-
-def deploy_set():
-  linode_order = []
-  for r in linode_api.batchFlush():
-    # TODO XXX FIXME handle error states
-    linodeid = r['DATA']['LinodeID']
-    created_linodes.append(linodeid)
-    linode_order.append(linodeid)
-    linode_api.linode_disk_createfromstackscript(
-      LinodeID=linodeid,
-      StackScriptID=options.stackscript,
-      StackScriptUDFResponses=stackscript_options,
-      DistributionID=options.distribution,
-      Label='From stackscript %d' % (options.stackscript),
-      Size=options.disksize,
-      rootPass=root_pass,
-    )
-  to_boot = []
-  for r in linode_api.batchFlush():
-    # TODO XXX FIXME handle error states
-    linodeid = linode_order.pop(0)
-    diskid = [str(r['DATA']['DiskID'])]
-    for i in range(8): diskid.append('')
-    linode_api.linode_config_create(
-      LinodeID=linodeid,
-      KernelID=options.kernel,
-      Label='From stackscript %d' % (options.stackscript),
-      DiskList=','.join(diskid),
-    )
-    if options.boot:
-      to_boot.append(linodeid)
-  linode_api.batchFlush()
-
-  for l in to_boot:
-    linode_api.linode_boot(LinodeID=l)
-
-  if len(to_boot):
-    linode_api.batchFlush()
+linode_api = api.Api(api_key)
+
+def disk_list(diskid):
+  return ','.join([str(diskid)] + [''] * 8)
+
+# Every node is a chain of create -> disk -> config (-> boot), the workflow
+# sends each link of every chain in the same batch
+flow = workflow.Workflow(linode_api)
+linodes = []
 
 for i in range(options.count):
-  if needFlush and i % 25 == 0:
-    needFlush = False
-    deploy_set()
-    
-  linode_api.linode_create(
-        DatacenterID=options.datacenter,
-        PlanID=options.plan,
-        PaymentTerm=options.term,
+  linode = flow.add('linode_create',
+    DatacenterID=options.datacenter,
+    PlanID=options.plan,
+    PaymentTerm=options.term,
+  )
+  disk = flow.add('linode_disk_createfromstackscript',
+    LinodeID=linode['LinodeID'],
+    StackScriptID=options.stackscript,
+    StackScriptUDFResponses=stackscript_options,
+    DistributionID=options.distribution,
+    Label='From stackscript %d' % (options.stackscript),
+    Size=options.disksize,
+    rootPass=root_pass,
   )
-  needFlush = True
+  config = flow.add('linode_config_create',
+    LinodeID=linode['LinodeID'],
+    KernelID=options.kernel,
+    Label='From stackscript %d' % (options.stackscript),
+    DiskList=disk['DiskID'].map(disk_list),
+  )
+  if options.boot:
+    flow.add('linode_boot', LinodeID=linode['LinodeID'], after=[config])
+  linodes.append(linode)
+
+flow.run()
+
+for step in flow.steps:
+  if step.error is not None:
+    sys.stderr.write('%s failed: %s%s' % (step.action, step.error, linesep))
 
-if needFlush:
-  needFlush = False
-  deploy_set()
+created_linodes = [l.result['LinodeID'] for l in linodes if l.error is None]
 
 print('List of created Linodes:')
 print('[%s]' % (', '.join([str(l) for l in created_linodes])))
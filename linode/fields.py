@@ -3,6 +3,8 @@ from datetime import datetime
 class Field(object):
   to_py = lambda self, value: value
   to_linode = to_py
+  # the LinodeObject class the field refers to, for ForeignFields
+  model = None
 
   def __init__(self, field):
     self.field = field
@@ -52,6 +54,14 @@ class ListField(Field):
     Field.__init__(self, field)
     self.__type=type
     self.__delim=delim
+    self.model = type.model
+
+  def ids(self, value):
+    ids = []
+    for v in (value or '').split(self.__delim):
+      if v != '':
+        ids.extend(self.__type.ids(v))
+    return ids
 
   def to_linode(self, value):
     return self.__delim.join([str(self.__type.to_linode(v)) for v in value])
@@ -66,10 +76,16 @@ class DateTimeField(Field):
 class ForeignField(Field):
   def __init__(self, field):
     self.field = field.primary_key
-    self.__model = field
+    self.model = field
+
+  def ids(self, value):
+    """The ids value refers to, without looking them up"""
+    if value is None or value == '':
+      return []
+    return [int(value)]
 
   def to_py(self, value):
-    return self.__model.get(id=value)
+    return self.model.get(id=value)
 
   def to_linode(self, value):
     if isinstance(value, int):
@@ -28,14 +28,194 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import json
 import logging
+import os
+import threading
+import time
 
+from collections import OrderedDict
+from decimal import Decimal
 from os import environ
 
-from api import Api, LowerCaseDict
+from api import Api, ApiError, ApiInfo, LowerCaseDict, to_structured
 from fields import *
 
+class _IdentityMap(object):
+  """The objects of one class by primary key, least recently used first.
+  Holds at most size objects, or any number when size is None.
+
+  Objects are also indexed by the value of each of columns, the lower case
+  names of fields in their entries."""
+
+  def __init__(self, size=None, columns=()):
+    self.size = size
+    self.__objects = OrderedDict()
+    self.__indexes = dict([(c, {}) for c in columns])
+    # of the row each object was last synced from
+    self.__fingerprints = {}
+    self.__lock = threading.Lock()
+
+  def get(self, key):
+    with self.__lock:
+      o = self.__objects.pop(key, None)
+      if o is not None:
+        self.__objects[key] = o
+      return o
+
+  def lookup(self, column, value):
+    """Returns the objects whose column holds value, or None when column
+    isn't indexed"""
+    index = self.__indexes.get(column)
+    if index is None:
+      return None
+    with self.__lock:
+      return [self.__objects[k] for k in index.get(value, ())]
+
+  def add(self, key, o):
+    """Caches o, or refreshes the object already cached for key with the
+    fields of o, and returns the cached object"""
+    with self.__lock:
+      self.__fingerprints.pop(key, None)
+      return self.__add(key, o)
+
+  def __add(self, key, o):
+    cached = self.__objects.pop(key, None)
+    if cached is not None:
+      self.__unindex(key, cached)
+      entry = o._LinodeObject__entry
+      # fields set on the cached object and not saved yet win over the
+      # ones just read
+      old = cached._LinodeObject__entry
+      for column in cached._LinodeObject__dirty:
+        entry[column] = dict.get(old, column)
+      cached._LinodeObject__entry = entry
+      o = cached
+    self.__objects[key] = o
+    self.__index(key, o)
+    while self.size is not None and len(self.__objects) > self.size:
+      self.__drop(next(iter(self.__objects)))
+    return o
+
+  def __drop(self, key):
+    o = self.__objects.pop(key, None)
+    if o is not None:
+      self.__unindex(key, o)
+    self.__fingerprints.pop(key, None)
+
+  def sync(self, cls, rows, complete=True):
+    """Brings the map in line with rows of cls read from the API: adds new
+    objects, refreshes those whose fields changed and, when rows are
+    complete, drops the objects missing from them.  Rows are told apart by
+    a fingerprint of their fields, so unchanged ones make no new object.
+    Returns the numbers of objects added, refreshed and dropped."""
+    pk = cls.primary_key.lower()
+    column = None
+    seen = set()
+    added = refreshed = dropped = 0
+    with self.__lock:
+      for row in rows:
+        if column is None or column not in row:
+          column = [k for k in row.keys() if k.lower() == pk][0]
+        key = row[column]
+        seen.add(key)
+        # whatever the case and order of the names, which differ between
+        # the API and a snapshot
+        fields = sorted((k.lower(), v) for k, v in row.items())
+        try:
+          fingerprint = hash(tuple(fields))
+        except TypeError:
+          # a field holding a list or dictionary
+          fingerprint = hash(repr(fields))
+        if key in self.__objects:
+          if self.__fingerprints.get(key) == fingerprint:
+            continue
+          refreshed += 1
+        else:
+          added += 1
+        self.__add(key, cls(row))
+        self.__fingerprints[key] = fingerprint
+      if complete:
+        for key in [k for k in self.__objects if k not in seen]:
+          self.__drop(key)
+          dropped += 1
+    return added, refreshed, dropped
+
+  def __index(self, key, o):
+    entry = o._LinodeObject__entry
+    for column, index in self.__indexes.items():
+      # columns are lower case already, skip LowerCaseDict.get
+      value = dict.get(entry, column)
+      if value is not None:
+        keys = index.get(value)
+        if keys is None:
+          keys = index[value] = {}
+        keys[key] = True
+
+  def __unindex(self, key, o):
+    entry = o._LinodeObject__entry
+    for column, index in self.__indexes.items():
+      value = dict.get(entry, column)
+      keys = index.get(value)
+      if keys is not None:
+        keys.pop(key, None)
+        if not keys:
+          del index[value]
+
+  def set(self, key, o, column, value):
+    """Sets column in the entry of o, moving o in the indexes if it is the
+    object held for key"""
+    with self.__lock:
+      held = column in self.__indexes and self.__objects.get(key) is o
+      if held:
+        self.__unindex(key, o)
+      o._LinodeObject__entry[column] = value
+      if held:
+        self.__index(key, o)
+
+  def remove(self, key):
+    with self.__lock:
+      self.__drop(key)
+
+  def clear(self):
+    with self.__lock:
+      self.__objects.clear()
+      self.__fingerprints.clear()
+      for index in self.__indexes.values():
+        index.clear()
+
+  def keys(self):
+    with self.__lock:
+      return list(self.__objects.keys())
+
+  def objects(self):
+    with self.__lock:
+      return list(self.__objects.values())
+
+  def __len__(self):
+    return len(self.__objects)
+
 _id_cache = {}
+_id_cache_lock = threading.Lock()
+
+def _cache(cls):
+  # the identity map of cls, made on first use
+  cache = _id_cache.get(cls)
+  if cache is None:
+    with _id_cache_lock:
+      columns = [cls.fields[name].field.lower() for name in cls.indexes]
+      cache = _id_cache.setdefault(cls, _IdentityMap(cls.cache_size, columns))
+  return cache
+
+# held while fill_cache() applies a refresh, see snapshot()
+_snapshot_lock = threading.RLock()
+
+def snapshot():
+  """Returns a lock to read the cache under, as in with snapshot():, so that
+  what is read comes from before or after a refresh, never part way"""
+  return _snapshot_lock
+
+log = logging.getLogger('linode.oop')
 
 ActiveContext = None
 
@@ -45,23 +225,26 @@ class LinodeObject(object):
   create_method = None
   primary_key   = None
   list_method   = None
+  # objects of the class kept in its identity map, None for no limit
+  cache_size    = 10000
+  # fields the identity map is also indexed by, for get() and find()
+  indexes       = ()
 
   def __init__(self, entry={}):
-    entry = dict([(str(k), v) for k,v in entry.items()])
     self.__entry = LowerCaseDict(entry)
 
   def __getattr__(self, name):
     name = name.replace('_LinodeObject', '')
     if name == '__entry':
       return self.__dict__[name]
+    elif name == '__dirty':
+      # the columns set since the object was read or saved
+      return self.__dict__.get(name, ())
     elif name not in self.fields:
       raise AttributeError
     else:
       f= self.fields[name]
-      value = None
-      if f.field.lower() in self.__entry:
-        value = self.__entry[f.field.lower()]
-      return f.to_py(value)
+      return f.to_py(self.__entry.get(f.field))
 
   def __setattr__(self, name, value):
     name = name.replace('_LinodeObject', '')
@@ -71,7 +254,14 @@ class LinodeObject(object):
       raise AttributeError
     else:
       f = self.fields[name]
-      self.__entry[f.field.lower()] = f.to_linode(value)
+      self.__dict__.setdefault('__dirty', set()).add(f.field.lower())
+      cache = _id_cache.get(self.__class__)
+      if cache is None:
+        self.__entry[f.field.lower()] = f.to_linode(value)
+      else:
+        # keep find() and get() on indexed fields in step with the change
+        key = self.__entry.get(self.primary_key)
+        cache.set(key, self, f.field.lower(), f.to_linode(value))
 
   def __str__(self):
     s = []
@@ -89,9 +279,12 @@ class LinodeObject(object):
       self.update()
     else:
       self.id = self.create_method(ActiveContext, **self.__entry)[self.primary_key]
+      self.__dict__.pop('__dirty', None)
+      self.cache_add()
 
   def update(self):
     self.update_method(ActiveContext, **self.__entry)
+    self.__dict__.pop('__dirty', None)
 
   @classmethod
   def __resolve_kwargs(self, kw):
@@ -102,68 +295,149 @@ class LinodeObject(object):
     return kwargs
 
   @classmethod
-  def list(self, **kw):
+  def list(self, columns=False, select_related=None, **kw):
+    """Yields the matching objects.  With columns=True returns their
+    fields as columns instead, named like the fields of the class, see
+    api.to_columns(); columns='structured' gives a NumPy record array.
+
+    select_related lists ForeignFields, or is True for all of them, whose
+    objects are loaded for every row at once, see prefetch().  The objects
+    are then returned as a list."""
     kwargs = self.__resolve_kwargs(kw)
+    if columns:
+      return self.__columns(kwargs, columns)
+    if select_related:
+      objects = list(self.__list(kwargs))
+      self.prefetch(objects, select_related)
+      return objects
+    return self.__list(kwargs)
 
-    """
-    if self not in _id_cache:
-      _id_cache[self] = {}
-    """
+  @classmethod
+  def prefetch(self, objects, fields=True):
+    """Loads the objects that the ForeignFields named in fields, or all of
+    them, refer to from objects into the identity map, in one batch, so
+    reading those fields makes no API calls.  Objects already in the map
+    aren't asked for again.
+
+    An id is looked up with the parameters its list method requires taken
+    from the row referring to it, e.g. the LinodeID of a LinodeConfig for
+    its disklist.  Ids that can't be are left to be fetched when read.
+    Classes whose list method takes no id are listed whole, once."""
+    if fields is True:
+      fields = [n for n, f in self.fields.items() if f.model is not None]
+    calls = []
+    seen = set()
+    for name in fields:
+      f = self.fields[name]
+      model = f.model
+      if model is None:
+        raise ValueError('%s is not a ForeignField of %s' % (name, self.__name__))
+      required, optional = ApiInfo.methods[model.list_method.__name__][:2]
+      # methods like avail_datacenters list every row in one call
+      by_key = model.primary_key.lower() in [p.lower() for p in required + optional]
+      cache = _cache(model)
+      for o in objects:
+        for key in f.ids(o.__entry.get(f.field)):
+          kwargs = {model.primary_key: key} if by_key else {}
+          for r in required:
+            if r not in kwargs:
+              kwargs[r] = o.__entry.get(r)
+          call = (model, tuple(sorted(kwargs.items())))
+          if call in seen or None in kwargs.values() or cache.get(key) is not None:
+            continue
+          seen.add(call)
+          calls.append((model, kwargs))
+
+    for (model, kwargs), rows in zip(calls, _batch(calls)):
+      for row in rows or []:
+        model(row).cache_add()
 
+  @classmethod
+  def __list(self, kwargs):
     for l in self.list_method(ActiveContext, **kwargs):
-      l = LowerCaseDict(l)
-      o = self(l)
-      o.cache_add()
-      yield o
+      yield self(l).cache_add()
+
+  @classmethod
+  def __columns(self, kwargs, kind):
+    found = self.list_method(ActiveContext, columns=True, **kwargs)
+    columns = LowerCaseDict()
+    for name, f in self.fields.items():
+      if f.field in found:
+        columns[name] = found[f.field]
+    if kind == 'structured':
+      return to_structured(columns)
+    return columns
 
   @classmethod
   def get(self, **kw):
+    """Returns the object matching kw.  When kw holds the id, or a field
+    listed in indexes, of an object in the identity map the API isn't asked.
+    Otherwise every object the API returns is cached, and the first one
+    matching kw returned.  Raises LookupError when none does."""
     kwargs = self.__resolve_kwargs(kw)
 
-    """
-    if self not in _id_cache:
-      _id_cache[self] = {}
-    """
-
-    result = None
-    """
-    for k,v in _id_cache[self].items():
-      found = True
-      for i, j in kwargs.items():
-        if i not in v or v[i] != j:
-          found = False
-          break
-      if not found:
-        continue
-      else:
-        result = v
-        break
-    """
+    for o in self.__find(kwargs) or ():
+      return o
 
+    # list methods ignore parameters they don't take, such as label
+    found = [self(r).cache_add() for r in self.list_method(ActiveContext, **kwargs)]
+    for o in found:
+      if o.__matches(kwargs, filtered=True):
+        return o
+    raise LookupError('No %s matches %s' % (self.__name__, kw))
 
-    if not result:
-      result = LowerCaseDict(self.list_method(ActiveContext, **kwargs)[0])
-      o = self(result)
-      o.cache_add()
-      return o
+  @classmethod
+  def find(self, **kw):
+    """Returns the objects in the identity map matching kw, which must
+    include the id or a field listed in indexes.  The API isn't asked."""
+    kwargs = self.__resolve_kwargs(kw)
+    found = self.__find(kwargs)
+    if found is None:
+      raise ValueError('%s has no index on any of %s' %
+                       (self.__name__, ', '.join(kw.keys())))
+    return found
+
+  @classmethod
+  def __find(self, kwargs):
+    # the cached objects matching kwargs, through the first indexed field
+    # in them, or None when there is none
+    cache = _cache(self)
+    key = kwargs.get(self.primary_key)
+    if key is not None:
+      o = cache.get(key)
+      found = [o] if o is not None else []
     else:
-      return self(result)
+      for column, value in kwargs.items():
+        found = cache.lookup(column.lower(), value)
+        if found is not None:
+          break
+      else:
+        return None
+    return [o for o in found if o.__matches(kwargs)]
+
+  def __matches(self, kwargs, filtered=False):
+    # rows filtered by the API don't hold the fields that are only filters
+    # of the list method, such as PendingOnly, those are taken as matching
+    for k, v in kwargs.items():
+      if filtered and k not in self.__entry:
+        continue
+      if self.__entry.get(k) != v:
+        return False
+    return True
 
   def cache_remove(self):
-    pass
-    """
-    del _id_cache[self.__class__][self.__entry[self.primary_key]]
-    """
+    key = self.__entry.get(self.primary_key)
+    if key is not None:
+      _cache(self.__class__).remove(key)
 
   def cache_add(self):
-    pass
-    """
-    key = self.__class__
-    if key not in _id_cache:
-      _id_cache[key] = {}
-
-    _id_cache[key][self.__entry[self.primary_key]] = self.__entry
-    """
+    """Adds the object to the identity map of its class.  Returns the
+    object the map holds for its id, which is updated with the fields of
+    this one when it was already there."""
+    key = self.__entry.get(self.primary_key)
+    if key is None:
+      return self
+    return _cache(self.__class__).add(key, self)
 
 class Datacenter(LinodeObject):
   fields = {
@@ -219,6 +493,7 @@ class Linode(LinodeObject):
   create_method = Api.linode_create
   primary_key   = 'LinodeID'
   list_method   = Api.linode_list
+  indexes       = ('label', 'group', 'datacenter')
 
   def boot(self):
     ### TODO XXX FIXME return LinodeJob
@@ -285,6 +560,7 @@ class LinodeDisk(LinodeObject):
   create_method = Api.linode_disk_create
   primary_key   = 'DiskID'
   list_method   = Api.linode_disk_list
+  indexes       = ('linode', )
 
   def duplicate(self):
     ret = ActiveContext.linode_disk_duplicate(linodeid=self.linode.id, diskid=self.id)
@@ -345,6 +621,7 @@ class LinodeConfig(LinodeObject):
   create_method = Api.linode_config_create
   primary_key   = 'ConfigID'
   list_method   = Api.linode_config_list
+  indexes       = ('linode', )
 
   def delete(self):
     self.cache_remove()
@@ -361,6 +638,7 @@ class LinodeIP(LinodeObject):
 
   list_method = Api.linode_ip_list
   primary_key = 'IPAddressID'
+  indexes     = ('address', 'linode')
 
 class Domain(LinodeObject):
   fields = {
@@ -381,6 +659,7 @@ class Domain(LinodeObject):
   create_method = Api.domain_create
   primary_key   = 'DomainID'
   list_method   = Api.domain_list
+  indexes       = ('domain', )
 
   STATUS_OFF  = 0
   STATUS_ON   = 1
@@ -408,6 +687,7 @@ class Resource(LinodeObject):
   create_method = Api.domain_resource_create
   primary_key   = 'ResourceID'
   list_method   = Api.domain_resource_list
+  indexes       = ('domain', 'name', 'type')
 
   def delete(self):
     self.cache_remove()
@@ -431,45 +711,208 @@ class Resource(LinodeObject):
     else:
       return r_by_type
 
-def _iter_class(self, results):
-  _id_cache[self] = {}
-  results = LowerCaseDict(results)
-
-  d = results['data']
-  for i in d: self(i).cache_add()
-
-def fill_cache():
-  _api.batching = True
-  _api.linode_list()
-  _api.avail_linodeplans()
-  _api.avail_datacenters()
-  _api.avail_distributions()
-  _api.avail_kernels()
-  _api.domain_list()
-  ret = _api.batchFlush()
-
-  for i,k in enumerate([Linode, LinodePlan, Datacenter, Distribution, Kernel, Domain]):
-    _iter_class(k, ret[i])
-
-  for k in _id_cache[Linode].keys():
-    _api.linode_config_list(linodeid=k)
-    _api.linode_disk_list(linodeid=k)
-
-  for k in _id_cache[Domain].keys():
-    _api.domain_resource_list(domainid=k)
-
-  ret = _api.batchFlush()
-
-  for r in ret:
+def _batch(calls, api=None):
+  """Sends the list calls of (class, kwargs) in one batch, through api or
+  ActiveContext, returning the rows of each, or None for those that failed"""
+  if not calls:
+    return []
+  if api is None:
+    api = ActiveContext
+  results = []
+  if api.autobatch:
+    pending = [model.list_method(api, **kwargs) for model, kwargs in calls]
+    api.batchFlush()
+    for f in pending:
+      try:
+        results.append(f.result())
+      except ApiError:
+        results.append(None)
+    return results
+
+  # sent as a batch of their own rather than by turning batching on, which
+  # would mix them up with calls already queued on api, and with those of
+  # other threads
+  requests = [ApiInfo.request_builders[model.list_method.__name__](api, kwargs)
+              for model, kwargs in calls]
+  responses = api._Api__send_batch(requests)
+
+  for r in responses:
     r = LowerCaseDict(r)
-    if r['action'] == 'linode.config.list':
-      _iter_class(LinodeConfig, r)
-    elif r['action'] == 'linode.disk.list':
-      _iter_class(LinodeDisk, r)
-    elif r['action'] == 'domain.resource.list':
-      _iter_class(Resource, r)
-
-  _api.batching = False
+    if len(r['ERRORARRAY']) > 0 and r['ERRORARRAY'][0]['ERRORCODE'] != 0:
+      results.append(None)
+    else:
+      results.append(r['DATA'])
+  return results
+
+def fill_cache(api=None):
+  """Loads every Linode, plan, datacenter, distribution, kernel and domain,
+  the configs and disks of each Linode and the resources of each domain
+  into the identity maps, in two batches.
+
+  Run again it applies only what changed: new objects are added, changed
+  ones refreshed in place and deleted ones dropped.  The changes are
+  applied under snapshot() once everything has been read.
+
+  Calls go through api, or ActiveContext.  Returns a dictionary of the
+  numbers of objects added, refreshed and dropped by class."""
+  if api is None:
+    api = ActiveContext
+  top = [Linode, LinodePlan, Datacenter, Distribution, Kernel, Domain]
+  found = dict(zip(top, _batch([(k, {}) for k in top], api)))
+
+  calls = []
+  for l in found[Linode] or []:
+    l = LowerCaseDict(l)
+    calls.append((LinodeConfig, {'LinodeID': l['LinodeID']}))
+    calls.append((LinodeDisk, {'LinodeID': l['LinodeID']}))
+  for d in found[Domain] or []:
+    calls.append((Resource, {'DomainID': LowerCaseDict(d)['DomainID']}))
+
+  # a class is only complete when the lists of every parent were read
+  complete = dict.fromkeys(top, True)
+  complete[LinodeConfig] = complete[LinodeDisk] = found[Linode] is not None
+  complete[Resource] = found[Domain] is not None
+  for k in (LinodeConfig, LinodeDisk, Resource):
+    found[k] = []
+  for (k, kwargs), rows in zip(calls, _batch(calls, api)):
+    if rows is None:
+      complete[k] = False
+    else:
+      found[k].extend(rows)
+
+  changes = {}
+  with _snapshot_lock:
+    for k, rows in found.items():
+      if rows is not None:
+        changes[k] = _cache(k).sync(k, rows, complete[k])
+  log.debug('fill_cache added, refreshed, dropped: %s', ', '.join(
+    ['%s %d/%d/%d' % ((k.__name__, ) + c) for k, c in changes.items()]))
+  return changes
+
+def save_cache(path, api=None):
+  """Saves the objects in the identity maps to the SQLite database at path,
+  as the snapshot of the account of api, or ActiveContext, replacing the
+  one saved before.  Returns the time it was saved at."""
+  import sqlite3
+  if api is None:
+    api = ActiveContext
+  account = api.key_digest()
+  with _snapshot_lock:
+    classes = [(k, _table([o._LinodeObject__entry for o in cache.objects()]))
+               for k, cache in list(_id_cache.items())]
+  saved = time.time()
+  db = sqlite3.connect(path)
+  try:
+    with db:
+      db.execute('CREATE TABLE IF NOT EXISTS snapshots (account TEXT, '
+                 'class TEXT, saved REAL, rows TEXT, PRIMARY KEY (account, class))')
+      db.execute('DELETE FROM snapshots WHERE account = ?', (account, ))
+      db.executemany('INSERT INTO snapshots VALUES (?, ?, ?, ?)',
+                     [(account, k.__name__, saved,
+                       json.dumps(rows, default=_encode_decimal))
+                      for k, rows in classes])
+  finally:
+    db.close()
+  return saved
+
+def load_cache(path, api=None, max_age=None):
+  """Fills the identity maps from the snapshot save_cache() kept at path
+  for the account of api, or ActiveContext.  Returns the time it was saved
+  at, or None, leaving the maps as they are, when there is no snapshot or
+  it is older than max_age seconds.
+
+  The objects are as old as the snapshot.  The next fill_cache(), or a
+  CacheRefresher, revalidates them and refreshes only those that changed.
+  """
+  import sqlite3
+  if not os.path.exists(path):
+    return None
+  if api is None:
+    api = ActiveContext
+  db = sqlite3.connect(path)
+  try:
+    found = db.execute('SELECT class, saved, rows FROM snapshots WHERE account = ?',
+                       (api.key_digest(), )).fetchall()
+  except sqlite3.OperationalError:
+    # not a snapshot database
+    return None
+  finally:
+    db.close()
+  if not found:
+    return None
+  saved = found[0][1]
+  if max_age is not None and time.time() - saved > max_age:
+    return None
+
+  with _snapshot_lock:
+    for name, _, rows in found:
+      cls = globals().get(name)
+      if isinstance(cls, type) and issubclass(cls, LinodeObject):
+        _cache(cls).sync(cls, _rows(json.loads(rows, object_hook=_decode_decimal)))
+  return saved
+
+def _table(entries):
+  # entries as [[names, [values, ...]], ...], the rows of a list share
+  # their fields so the names are written once per layout
+  groups = []
+  layout = None
+  for e in entries:
+    names = list(e.keys())
+    if names != layout:
+      layout = names
+      groups.append([names, []])
+    groups[-1][1].append(list(e.values()))
+  return groups
+
+def _rows(groups):
+  return [dict(zip(names, values)) for names, rows in groups for values in rows]
+
+def _encode_decimal(value):
+  # the json module can only write a Decimal as a float, which loses digits
+  # past the 17th, so its text goes out in an object of its own
+  return {'__decimal__': str(value)}
+
+def _decode_decimal(o):
+  if len(o) == 1 and '__decimal__' in o:
+    return Decimal(o['__decimal__'])
+  return o
+
+class CacheRefresher(threading.Thread):
+  """Runs fill_cache(api) every interval seconds, on a daemon thread, until
+  stop() is called.  With a path, the cache is saved there with
+  save_cache() after each refresh.
+
+  Give it an Api of its own: fill_cache switches on batching while it
+  sends its calls, which would batch the calls of other threads too.
+  The exception of a failed refresh is logged and kept in error.
+  """
+
+  def __init__(self, api, interval=300, path=None):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.api = api
+    self.interval = interval
+    self.path = path
+    self.error = None
+    self.refreshed = None
+    self.__stopped = threading.Event()
+
+  def run(self):
+    while not self.__stopped.is_set():
+      try:
+        fill_cache(self.api)
+        if self.path is not None:
+          save_cache(self.path, self.api)
+        self.error = None
+        self.refreshed = time.time()
+      except Exception as ex:
+        log.exception('Refreshing the cache failed')
+        self.error = ex
+      self.__stopped.wait(self.interval)
+
+  def stop(self):
+    """Stops refreshing once the refresh under way, if any, is done"""
+    self.__stopped.set()
 
 def setup_logging():
   logging.basicConfig(level=logging.DEBUG)
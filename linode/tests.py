@@ -1,7 +1,28 @@
 import api
 import unittest
 import os
+from collections import OrderedDict
+import logging
+import workflow
+import oop
+from decimal import Decimal
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
 from getpass import getpass
+from io import BytesIO
+try:
+    from urlparse import parse_qs
+except ImportError:
+    # Python 3
+    from urllib.parse import parse_qs
+try:
+    import VEpycurl
+except ImportError:
+    VEpycurl = None
 
 class ApiTest(unittest.TestCase):
 
@@ -20,6 +41,1393 @@ class ApiTest(unittest.TestCase):
         self.assertEqual(test_parameters['FOO'], response['FOO'])
         self.assertEqual(test_parameters['FIZZ'], response['FIZZ'])
 
+class LowerCaseDictTest(unittest.TestCase):
+
+    def testCaseInsensitive(self):
+        d = api.LowerCaseDict({'LinodeID': 1, 'LABEL': 'web'})
+        self.assertEqual(1, d['LINODEID'])
+        self.assertEqual('web', d.get('label'))
+        self.assertTrue('linodeid' in d)
+        d['Status'] = 2
+        self.assertEqual(['label', 'linodeid', 'status'], sorted(d.keys()))
+        del d['STATUS']
+        self.assertEqual(None, d.pop('status'))
+
+    def testConstruction(self):
+        pairs = [('A', 1), ('b', 2)]
+        self.assertEqual({'a': 1, 'b': 2}, api.LowerCaseDict(pairs))
+        first = api.LowerCaseDict({'TOTALRAM': 1})
+        second = api.LowerCaseDict({'TOTALRAM': 2})
+        self.assertTrue(list(first.keys())[0] is list(second.keys())[0])
+        self.assertEqual(first, api.LowerCaseDict(first))
+
+class JsonBackendTest(unittest.TestCase):
+
+    response = '{"ERRORARRAY": [], "ACTION": "avail.linodeplans", ' \
+               '"DATA": [{"PLANID": 1, "PRICE": 10.05}]}'
+
+    def price(self, **kw):
+        a = api.Api('x', **kw)
+        return a._parse_response(self.response)[0]['PRICE']
+
+    def testNumberModes(self):
+        self.assertEqual(Decimal('10.05'), self.price())
+        self.assertEqual(10.05, self.price(numbers='float'))
+        lazy = self.price(numbers='lazy')
+        self.assertTrue(isinstance(lazy, api.LazyNumber))
+        self.assertEqual(Decimal('10.05'), lazy.decimal())
+        self.assertEqual(10.05, float(lazy))
+        self.assertEqual(10, int(lazy))
+        self.assertEqual('10.05', str(lazy))
+        self.assertEqual(Decimal('20.10'), lazy * 2)
+        self.assertEqual(Decimal('20.10'), sum([lazy, lazy]))
+        self.assertEqual(Decimal('0.05'), lazy - 10)
+        self.assertAlmostEqual(10.55, lazy + 0.5)
+        self.assertTrue(lazy > 5 and lazy < 10.1 and 11 > lazy)
+        self.assertEqual(Decimal('10.05'), lazy)
+        self.assertEqual(hash(Decimal('10.05')), hash(lazy))
+        self.assertEqual(lazy, pickle.loads(pickle.dumps(lazy)))
+        self.assertRaises(TypeError, api.json.dumps, lazy)
+
+    def testFallback(self):
+        for backend in api.json_backends():
+            a = api.Api('x', json_backend=backend, numbers='decimal')
+            self.assertEqual(Decimal('10.05'),
+                             a._parse_response(self.response)[0]['PRICE'])
+        self.assertRaises(ValueError, api.Api, 'x', json_backend='nope')
+        self.assertRaises(ValueError, api.Api, 'x', numbers='double')
+
+class PiecePool(object):
+    """A pool whose responses arrive a byte at a time"""
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+
+    def open(self, request):
+        return self
+
+    def read(self):
+        return self.body
+
+    def stream(self, request):
+        for i in range(len(self.body)):
+            yield self.body[i:i + 1]
+
+class StreamTest(unittest.TestCase):
+
+    def testRows(self):
+        rows = [{'LABEL': u'caf\u00e9 %d' % i, 'PRICE': 1.5, 'ID': 10 * i}
+                for i in range(5)]
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'avail.linodeplans',
+                               'DATA': rows}, indent=1)
+        a = api.Api('x', pool=PiecePool(body))
+        got = list(a.iter_avail_linodeplans())
+        self.assertEqual(5, len(got))
+        self.assertEqual(u'caf\u00e9 4', got[4]['LABEL'])
+        self.assertEqual(40, got[4]['ID'])
+        self.assertEqual(Decimal('1.5'), got[0]['PRICE'])
+
+    def testFields(self):
+        rows = [{'LINODEID': i, 'LABEL': 'web-%d' % i, 'TOTALRAM': 1024,
+                 'ALERT_CPU_ENABLED': 1} for i in range(3)]
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': rows})
+        a = api.Api('x', pool=PiecePool(body))
+        self.assertEqual([{'LINODEID': i, 'LABEL': 'web-%d' % i} for i in range(3)],
+                         a.linode_list(fields=['LinodeID', 'label']))
+        self.assertEqual([{'TOTALRAM': 1024}] * 3,
+                         list(a.iter_linode_list(fields=['TOTALRAM'])))
+
+    def testError(self):
+        body = '{"ERRORARRAY":[{"ERRORCODE":5,"ERRORMESSAGE":"x"}],' \
+               '"DATA":{},"ACTION":"linode.list"}'
+        a = api.Api('x', pool=PiecePool(body))
+        self.assertRaises(api.ApiError, list, a.iter_linode_list())
+
+    def testListsOnly(self):
+        for name in api.ApiInfo.valid_commands:
+            if not api.is_read_action(name):
+                self.assertFalse(hasattr(api.Api, 'iter_' + name), name)
+        self.assertFalse(hasattr(api.Api, 'iter_linode_resize'))
+        self.assertTrue(hasattr(api.Api, 'iter_linode_list'))
+
+class RecordTest(unittest.TestCase):
+
+    def testAccess(self):
+        cls = api._record_class('linode_list')
+        r = cls.from_row({'LINODEID': 7, 'LABEL': 'web', 'NEWFIELD': 1})
+        self.assertEqual(7, r.linodeid)
+        self.assertEqual('web', r.LABEL)
+        self.assertEqual('web', r['Label'])
+        self.assertEqual(1, r['newfield'])
+        self.assertEqual(None, r.get('TOTALRAM'))
+        self.assertFalse('totalram' in r)
+        self.assertRaises(KeyError, lambda: r['TOTALRAM'])
+        self.assertRaises(AttributeError, lambda: r.totalram)
+        self.assertEqual({'LinodeID': 7, 'label': 'web', 'newfield': 1}, r)
+        self.assertEqual(r, pickle.loads(pickle.dumps(r)))
+        self.assertEqual(r, api.LowerCaseDict(r))
+
+    def testApi(self):
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': [{'LINODEID': 1, 'LABEL': 'a'}]})
+        a = api.Api('x', pool=PiecePool(body), records=True)
+        self.assertEqual('a', list(a.iter_linode_list())[0].label)
+        self.assertTrue(isinstance(a._parse_response(body)[0], api.Record))
+
+class ColumnsTest(unittest.TestCase):
+
+    def testTypes(self):
+        c = api.to_columns([{'ID': 1, 'PRICE': 2, 'LABEL': 'a'},
+                            {'ID': 2, 'PRICE': Decimal('2.5'), 'LABEL': 'b'},
+                            {'id': 3, 'LABEL': 'a', 'AVAIL': {'2': 1}}])
+        self.assertEqual([1, 2, 3], list(c['id']))
+        self.assertEqual([2.0, 2.5], list(c['Price'])[:2])
+        self.assertTrue(c['price'][2] != c['price'][2])  # NaN
+        self.assertEqual(['a', 'b'], list(c['label'].values))
+        self.assertEqual([0, 1, 0], list(c['label'].codes))
+        self.assertEqual(['a', 'b', 'a'], c['label'].decode())
+        self.assertEqual([None, None, {'2': 1}], list(c['avail']))
+        self.assertEqual({}, api.to_columns([]))
+
+    def testApi(self):
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': [{'LINODEID': 1, 'TOTALRAM': 1024},
+                                        {'LINODEID': 2, 'TOTALRAM': 2048}]})
+        a = api.Api('x', pool=PiecePool(body))
+        self.assertEqual([1024, 2048], list(a.linode_list(columns=True)['totalram']))
+        c = a.linode_list(columns=True, fields=['LinodeID'])
+        self.assertEqual(['linodeid'], list(c.keys()))
+
+class CountingPool(PiecePool):
+    """A PiecePool counting the requests it answers"""
+
+    opens = 0
+
+    def open(self, request):
+        self.opens += 1
+        return self
+
+class IdentityMapTest(unittest.TestCase):
+
+    def setUp(self):
+        rows = [{'LINODEID': i, 'LABEL': 'web-%d' % i} for i in range(3)]
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': rows})
+        self.pool = CountingPool(body)
+        oop.ActiveContext = api.Api('x', pool=self.pool)
+        oop._id_cache.clear()
+
+    def tearDown(self):
+        oop.ActiveContext = None
+        oop._id_cache.clear()
+
+    def testGet(self):
+        l = oop.Linode.get(id=0)
+        self.assertTrue(l is oop.Linode.get(id=0))
+        self.assertEqual(1, self.pool.opens)
+        linodes = list(oop.Linode.list())
+        self.assertTrue(l is linodes[0])
+        self.assertTrue(linodes[2] is oop.Linode.get(id=2, label='web-2'))
+        self.assertEqual(2, self.pool.opens)
+        l.cache_remove()
+        self.assertEqual('web-0', oop.Linode.get(id=0).label)
+        self.assertEqual(3, self.pool.opens)
+
+    def testEviction(self):
+        cache = oop._IdentityMap(2)
+        for i in range(3):
+            cache.add(i, oop.Linode({'LinodeID': i}))
+        cache.get(1)
+        cache.add(3, oop.Linode({'LinodeID': 3}))
+        self.assertEqual([1, 3], cache.keys())
+
+class TableApi(api.Api):
+    """An Api answering list calls from rows per action, without a network"""
+
+    def __init__(self, tables, key='x'):
+        api.Api.__init__(self, key)
+        self.tables = tables
+        self.sent = []
+
+    def answer(self, request):
+        rows = self.tables[request['api_action']]
+        # like the API, filter by the parameters the method takes only
+        required, optional = api.ApiInfo.methods[request['api_action'].replace('.', '_')][:2]
+        for k in required + optional:
+            if k in request:
+                # rows lack the fields that are only filters, take those as applied
+                rows = [r for r in rows
+                        if api.LowerCaseDict(r).get(k, request[k]) == request[k]]
+        # rows keep the case of their field names, as the API's do
+        return {'ACTION': request['api_action'], 'ERRORARRAY': [],
+                'DATA': [dict(r) for r in rows]}
+
+    def _Api__send_request(self, request, actions=None):
+        self.sent.append(request['api_action'])
+        if request['api_action'] == 'batch':
+            return [self.answer(r) for r in api.json.loads(request['api_requestArray'])]
+        return self.answer(request)['DATA']
+
+class PrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = oop.ActiveContext = TableApi({
+            'linode.config.list': [
+                {'ConfigID': i, 'LinodeID': i % 2, 'KernelID': 1,
+                 'DiskList': '%d,%d,,' % (2 * i, 2 * i + 1)} for i in range(4)],
+            'linode.disk.list': [
+                {'DiskID': i, 'LinodeID': i // 2 % 2, 'Label': 'disk %d' % i}
+                for i in range(8)],
+            'linode.list': [{'LinodeID': i, 'Label': 'web-%d' % i} for i in range(2)],
+            'avail.kernels': [{'KernelID': 1, 'Label': 'Latest'}],
+        })
+        oop._id_cache.clear()
+
+    def tearDown(self):
+        oop.ActiveContext = None
+        oop._id_cache.clear()
+
+    def testSelectRelated(self):
+        configs = oop.LinodeConfig.list(linode=0, select_related=True)
+        self.assertEqual(['linode.config.list', 'batch'], self.api.sent)
+        self.assertEqual('Latest', configs[0].kernel.label)
+        self.assertEqual(['disk 4', 'disk 5'], [d.label for d in configs[1].disklist])
+        self.assertTrue(configs[0].linode is configs[1].linode)
+        self.assertEqual(2, len(self.api.sent))
+
+    def testCached(self):
+        oop.Kernel.get(id=1)
+        configs = oop.LinodeConfig.list(linode=1, select_related=['kernel'])
+        self.assertEqual(['avail.kernels', 'linode.config.list'], self.api.sent)
+        self.assertRaises(ValueError, oop.LinodeConfig.prefetch, configs, ['label'])
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = oop.ActiveContext = TableApi({
+            'linode.list': [{'LinodeID': i, 'Label': 'web-%d' % i,
+                             'LPM_DISPLAYGROUP': 'group-%d' % (i % 2)}
+                            for i in range(4)],
+            'linode.ip.list': [{'IPAddressID': 10 + i, 'LinodeID': i,
+                                'IPADDRESS': '10.0.0.%d' % i} for i in range(4)],
+        })
+        oop._id_cache.clear()
+
+    def tearDown(self):
+        oop.ActiveContext = None
+        oop._id_cache.clear()
+
+    def testGet(self):
+        self.assertEqual(2, oop.Linode.get(label='web-2').id)
+        self.assertEqual(3, oop.Linode.get(name='web-3').id)
+        self.assertEqual(1, len(self.api.sent))
+        self.assertEqual([0, 2], sorted([l.id for l in oop.Linode.find(group='group-0')]))
+        ip = oop.LinodeIP.get(address='10.0.0.1')
+        self.assertTrue(ip.linode is oop.Linode.get(id=1))
+        self.assertTrue(ip is oop.LinodeIP.find(linode=1)[0])
+        self.assertEqual(2, len(self.api.sent))
+        self.assertRaises(ValueError, oop.Linode.find, status=1)
+
+    def testUpdate(self):
+        l = oop.Linode.get(id=1)
+        self.api.tables['linode.list'][1]['Label'] = 'db-1'
+        self.assertTrue(l is oop.Linode.get(label='db-1'))
+        self.assertEqual([], oop.Linode.find(label='web-1'))
+        l.cache_remove()
+        self.assertEqual([], oop.Linode.find(label='db-1'))
+
+    def testMiss(self):
+        self.assertRaises(LookupError, oop.Linode.get, label='no-such')
+        self.assertEqual(4, len(oop._id_cache[oop.Linode]))
+        self.assertRaises(LookupError, oop.Linode.get, id=7)
+
+    def testFilterOnly(self):
+        self.api.tables['linode.job.list'] = [
+            {'JobID': 5, 'LinodeID': 1, 'Label': 'boot', 'HOST_SUCCESS': ''}]
+        job = oop.LinodeJob.get(linode=1, pending_only=True)
+        self.assertEqual(5, job.id)
+        self.assertEqual(['linode.job.list'], self.api.sent[-1:])
+        # fields the rows do hold still have to match
+        self.assertRaises(LookupError, oop.LinodeJob.get, linode=1,
+                          pending_only=True, label='shutdown')
+
+    def testSetField(self):
+        l = oop.Linode.get(id=1)
+        l.label = 'renamed'
+        self.assertEqual([l], oop.Linode.find(label='renamed'))
+        self.assertEqual([], oop.Linode.find(label='web-1'))
+        self.assertTrue(l is oop.Linode.get(label='renamed'))
+        self.assertEqual(1, len(self.api.sent))
+        # a copy that isn't the cached object leaves the indexes alone
+        copy = oop.Linode({'LinodeID': 1, 'Label': 'renamed'})
+        copy.label = 'other'
+        self.assertEqual([], oop.Linode.find(label='other'))
+
+    def testUnsavedField(self):
+        l = oop.Linode.get(id=1)
+        l.label = 'renamed'
+        self.api.tables['linode.list'][1]['LPM_DISPLAYGROUP'] = 'moved'
+        self.assertTrue(l is list(oop.Linode.list())[1])
+        self.assertEqual(('renamed', 'moved'), (l.label, l.group))
+        self.assertEqual([l], oop.Linode.find(label='renamed'))
+        self.api.tables['linode.update'] = []
+        l.save()
+        self.assertEqual('linode.update', self.api.sent[-1])
+        list(oop.Linode.list())
+        self.assertEqual('web-1', l.label)
+
+def account_api(key='x'):
+    """A TableApi holding a small account, as fill_cache reads it"""
+    return TableApi({
+        'linode.list': [{'LinodeID': i, 'Label': 'web-%d' % i} for i in range(3)],
+        'linode.config.list': [{'ConfigID': i, 'LinodeID': i} for i in range(3)],
+        'linode.disk.list': [{'DiskID': i, 'LinodeID': i % 3} for i in range(6)],
+        'domain.list': [{'DomainID': 1, 'Domain': 'example.com'}],
+        'domain.resource.list': [{'ResourceID': 1, 'DomainID': 1, 'Name': 'www'}],
+        'avail.linodeplans': [{'PlanID': 1, 'PRICE': Decimal('10.050000000000000000001'),
+                               'HOURLY': 0.015}],
+        'avail.datacenters': [{'DatacenterID': 2}],
+        'avail.distributions': [],
+        'avail.kernels': [{'KernelID': 1}],
+    }, key)
+
+class FillCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = account_api()
+        oop._id_cache.clear()
+
+    def tearDown(self):
+        oop._id_cache.clear()
+
+    def testDelta(self):
+        changes = oop.fill_cache(self.api)
+        self.assertEqual((6, 0, 0), changes[oop.LinodeDisk])
+        self.assertEqual(['batch', 'batch'], self.api.sent)
+        web = oop.Linode.find(id=1)[0]
+
+        tables = self.api.tables
+        tables['linode.list'][1]['Label'] = 'db-1'
+        del tables['linode.disk.list'][5]
+        tables['domain.resource.list'].append({'ResourceID': 2, 'DomainID': 1})
+        changes = oop.fill_cache(self.api)
+        self.assertEqual((0, 1, 0), changes[oop.Linode])
+        self.assertEqual((0, 0, 1), changes[oop.LinodeDisk])
+        self.assertEqual((1, 0, 0), changes[oop.Resource])
+        self.assertEqual((0, 0, 0), changes[oop.LinodeConfig])
+        self.assertTrue(web is oop.Linode.find(label='db-1')[0])
+        self.assertEqual(5, len(oop._id_cache[oop.LinodeDisk]))
+
+    def testQueuedCalls(self):
+        self.api.batching = True
+        self.api.avail_datacenters()
+        oop.fill_cache(self.api)
+        self.assertEqual(3, len(oop._id_cache[oop.Linode]))
+        # the call queued before is left alone, and so is batching
+        self.assertTrue(self.api.batching)
+        responses = self.api.batchFlush()
+        self.assertEqual(['avail.datacenters'], [r['ACTION'] for r in responses])
+
+    def testFieldOrder(self):
+        cache = oop._IdentityMap()
+        rows = [OrderedDict([('LinodeID', i), ('Label', 'web-%d' % i),
+                             ('TOTALRAM', 1024)]) for i in range(50)]
+        self.assertEqual((50, 0, 0), cache.sync(oop.Linode, rows))
+        # a snapshot gives the fields lowered, in another order
+        rows = [OrderedDict(reversed([(k.lower(), v) for k, v in r.items()]))
+                for r in rows]
+        self.assertEqual((0, 0, 0), cache.sync(oop.Linode, rows))
+        rows[3]['label'] = 'db-3'
+        self.assertEqual((0, 1, 0), cache.sync(oop.Linode, rows))
+
+    def testRefresher(self):
+        refresher = oop.CacheRefresher(self.api, interval=60)
+        refresher.start()
+        for i in range(500):
+            if refresher.refreshed is not None:
+                break
+            time.sleep(0.01)
+        refresher.stop()
+        refresher.join(5)
+        self.assertFalse(refresher.is_alive())
+        self.assertEqual(None, refresher.error)
+        self.assertEqual(3, len(oop._id_cache[oop.Linode]))
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = account_api()
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+        oop._id_cache.clear()
+
+    def tearDown(self):
+        oop._id_cache.clear()
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def testWarmStart(self):
+        self.assertEqual(None, oop.load_cache(self.path, self.api))
+        oop.fill_cache(self.api)
+        saved = oop.save_cache(self.path, self.api)
+        oop._id_cache.clear()
+
+        self.assertEqual(None, oop.load_cache(self.path, account_api('y')))
+        self.assertEqual(saved, oop.load_cache(self.path, self.api))
+        self.assertEqual(6, len(oop._id_cache[oop.LinodeDisk]))
+        self.assertEqual('web-2', oop.Linode.find(id=2)[0].label)
+        plan = oop.LinodePlan.find(id=1)[0]._LinodeObject__entry
+        self.assertEqual(Decimal('10.050000000000000000001'), plan['price'])
+        self.assertEqual(0.015, plan['hourly'])
+        self.assertEqual(None, oop.load_cache(self.path, self.api, max_age=-1))
+
+        changes = oop.fill_cache(self.api)
+        self.assertEqual((0, 0, 0), changes[oop.Linode])
+
+class BatchRecorder(object):
+    """Stands in for Api, answering batches with canned results"""
+    autobatch = False
+
+    def __init__(self):
+        self.batching = False
+        self.batches = []
+        self.pending = []
+
+    def __getattr__(self, name):
+        def call(**kw):
+            self.pending.append((name, kw))
+        return call
+
+    def batchFlush(self):
+        self.batches.append(self.pending)
+        responses = []
+        for name, kw in self.pending:
+            if name == 'linode_create':
+                data = {'LinodeID': 100 + len(responses)}
+                errors = []
+            elif name == 'test_echo' and kw.get('fail'):
+                data = {}
+                errors = [{'ERRORCODE': 8, 'ERRORMESSAGE': 'failed'}]
+            else:
+                data = kw
+                errors = []
+            responses.append({'ACTION': name, 'ERRORARRAY': errors, 'DATA': data})
+        self.pending = []
+        return responses
+
+class WorkflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = BatchRecorder()
+        self.flow = workflow.Workflow(self.api)
+
+    def testWaves(self):
+        for i in range(3):
+            linode = self.flow.add('linode_create', DatacenterID=2, PlanID=1)
+            self.flow.add('linode_boot', LinodeID=linode['LinodeID'])
+        results = self.flow.run()
+        self.assertEqual(2, len(self.api.batches))
+        self.assertEqual(['linode_create'] * 3, [n for n, kw in self.api.batches[0]])
+        self.assertEqual([100, 101, 102], [kw['LinodeID'] for n, kw in self.api.batches[1]])
+        self.assertEqual({'LinodeID': 101}, results[3])
+        self.assertFalse(self.api.batching)
+
+    def testFailurePropagates(self):
+        failed = self.flow.add('test_echo', fail=True)
+        skipped = self.flow.add('test_echo', value=failed['value'].map(str))
+        self.flow.run()
+        self.assertTrue(isinstance(failed.error, api.ApiError))
+        self.assertTrue(isinstance(skipped.error, workflow.StepFailed))
+        self.assertEqual(1, len(self.api.batches))
+
+    def testMissingArgument(self):
+        self.assertRaises(api.MissingRequiredArgument, self.flow.add, 'linode_boot')
+
+    def testQueuedCalls(self):
+        a = EchoApi(batching=True)
+        a.test_echo(n=0)
+        flow = workflow.Workflow(a)
+        flow.add('test_echo', n=1)
+        self.assertRaises(Exception, flow.run)
+        self.assertEqual([], a.sent)
+        a.batchFlush()
+        self.assertEqual([{'n': 1}], flow.run())
+
+    def testPartialBatch(self):
+        a = EchoApi(batch_size=1)
+        flow = workflow.Workflow(a)
+        ok = flow.add('test_echo', n=1)
+        lost = flow.add('test_echo', fail='chunk')
+        after = flow.add('test_echo', n=ok['n'], after=[lost])
+        flow.run()
+        self.assertEqual({'n': 1}, ok.result)
+        self.assertTrue(isinstance(lost.error, IOError))
+        self.assertTrue(isinstance(after.error, workflow.StepFailed))
+
+    @unittest.skipIf(api.futures is None, 'needs futures')
+    def testPartialAutobatch(self):
+        a = EchoApi(autobatch=True, batch_size=1)
+        flow = workflow.Workflow(a)
+        ok = flow.add('test_echo', n=1)
+        lost = flow.add('test_echo', fail='chunk')
+        after = flow.add('test_echo', n=ok['n'], after=[lost])
+        flow.run()
+        self.assertEqual({'n': 1}, ok.result)
+        self.assertTrue(isinstance(lost.error, IOError))
+        self.assertTrue(isinstance(after.error, workflow.StepFailed))
+
+    def testMissingField(self):
+        a = EchoApi()
+        flow = workflow.Workflow(a)
+        first = flow.add('test_echo', n=1)
+        missing = flow.add('test_echo', n=first['NoSuchField'])
+        sibling = flow.add('test_echo', n=first['n'])
+        last = flow.add('test_echo', n=missing['n'])
+        self.assertEqual([{'n': 1}, None, {'n': 1}, None], flow.run())
+        self.assertTrue(isinstance(missing.error, workflow.StepFailed))
+        self.assertTrue('nosuchfield' in str(missing.error).lower())
+        self.assertTrue(isinstance(last.error, workflow.StepFailed))
+        self.assertEqual(None, sibling.error)
+
+def echo_response(call):
+    """The raw response of the fake API to one call: its own parameters, or
+    the ApiError asked for with error=code"""
+    data = dict((k, v) for k, v in call.items() if k.lower() != 'api_action')
+    errors = []
+    if call.get('error'):
+        errors = [{'ERRORCODE': int(call['error']), 'ERRORMESSAGE': 'failed'}]
+    return {'ACTION': call['api_action'], 'ERRORARRAY': errors, 'DATA': data}
+
+class EchoApi(api.Api):
+    """An Api answering every call with its parameters, without a network.
+    A request holding a call with fail='chunk' fails to send, and one with
+    delay=seconds takes that long, unless delays lists the time the next
+    requests take.  calls lists every call answered, batched or not"""
+
+    def __init__(self, key='x', **kw):
+        api.Api.__init__(self, key, **kw)
+        self.sent = []
+        self.calls = []
+        self.delays = []
+        self.lock = threading.Lock()
+
+    def _Api__send_once(self, request):
+        if request['api_action'] == 'batch':
+            calls = api.json.loads(request['api_requestArray'])
+        else:
+            calls = [request]
+        with self.lock:
+            self.sent.append(request['api_action'])
+            self.calls.extend(calls)
+            if self.delays:
+                delay = self.delays.pop(0)
+            else:
+                delay = max([float(c.get('delay', 0)) for c in calls])
+        time.sleep(delay)
+        if [c for c in calls if c.get('fail') == 'chunk']:
+            raise IOError('connection reset')
+        if request['api_action'] == 'batch':
+            return [echo_response(c) for c in calls]
+        response = echo_response(request)
+        if response['ERRORARRAY']:
+            raise api.ApiError(response['ERRORARRAY'])
+        return response['DATA']
+
+class FuturePool(object):
+    """An AsyncPool answering batches like EchoApi, or every request with
+    body, through futures"""
+
+    def __init__(self, body=None):
+        self.body = body
+
+    def open(self, url, fields, headers):
+        import asyncio
+        answer = asyncio.Future()
+        if self.body is not None:
+            answer.set_result(self.body.encode('utf-8'))
+            return answer
+        calls = api.json.loads(fields['api_requestArray'])
+        if [c for c in calls if c.get('fail') == 'chunk']:
+            answer.set_exception(IOError('connection reset'))
+        else:
+            body = api.json.dumps([echo_response(c) for c in calls])
+            answer.set_result(body.encode('utf-8'))
+        return answer
+
+class ChunkTest(unittest.TestCase):
+
+    def testOrder(self):
+        a = EchoApi(batching=True, batch_size=3)
+        for i in range(10):
+            # the first chunk answers last
+            a.test_echo(n=i, delay=i < 3 and 0.05 or 0)
+        results = a.batchFlush()
+        self.assertEqual(list(range(10)), [r['DATA']['n'] for r in results])
+        self.assertEqual(['batch'] * 4, a.sent)
+
+    def testPartialFailure(self):
+        a = EchoApi(batching=True, batch_size=2)
+        for i in range(6):
+            a.test_echo(n=i, fail=i == 2 and 'chunk' or '')
+        try:
+            a.batchFlush()
+            self.fail('BatchError not raised')
+        except api.BatchError as ex:
+            self.assertEqual(1, len(ex.errors))
+            self.assertTrue(isinstance(ex.errors[0], IOError))
+            self.assertTrue(ex.results[2] is ex.errors[0])
+            self.assertTrue(ex.results[3] is ex.errors[0])
+            self.assertEqual([0, 1, 4, 5], [r['DATA']['n'] for r in ex.results
+                                            if isinstance(r, dict)])
+        a.batch_size = 10
+        a.test_echo(fail='chunk')
+        self.assertRaises(IOError, a.batchFlush)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'asyncio needs Python 3.5')
+    def testAsync(self):
+        import asyncio
+        import aio
+        a = aio.AsyncApi('x', batching=True, batch_size=2, pool=FuturePool())
+        for i in range(5):
+            a.test_echo(n=i, fail=i == 4 and 'chunk' or '')
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertRaises(api.BatchError, loop.run_until_complete, a.batchFlush())
+            for i in range(3):
+                a.test_echo(n=i)
+            results = loop.run_until_complete(a.batchFlush())
+        finally:
+            loop.close()
+        self.assertEqual([0, 1, 2], [r['DATA']['n'] for r in results])
+
+@unittest.skipIf(api.futures is None, 'needs futures')
+class AutobatchTest(unittest.TestCase):
+
+    def testFutures(self):
+        a = EchoApi(autobatch=True, batch_size=3, batch_window=10)
+        calls = [a.test_echo(n=i, error=i == 1 and 4 or 0) for i in range(3)]
+        # a full queue goes out at once, without waiting for the window
+        self.assertEqual(0, calls[0].result(5)['n'])
+        self.assertEqual(2, calls[2].result(5)['n'])
+        try:
+            calls[1].result(5)
+            self.fail('ApiError not raised')
+        except api.ApiError as ex:
+            self.assertEqual(4, ex.value[0]['ERRORCODE'])
+        self.assertEqual(['batch'], a.sent)
+
+    def testWindow(self):
+        a = EchoApi(autobatch=True, batch_window=0.01)
+        calls = [a.test_echo(n=i) for i in range(2)]
+        self.assertEqual([0, 1], [c.result(5)['n'] for c in calls])
+        self.assertEqual(['batch'], a.sent)
+
+    def testFlush(self):
+        a = EchoApi(autobatch=True, batch_size=2, batch_window=10)
+        calls = [a.test_echo(n=i, fail=i == 2 and 'chunk' or '') for i in range(3)]
+        a.batchFlush()
+        self.assertTrue(calls[2].done())
+        self.assertEqual(1, calls[1].result()['n'])
+        self.assertRaises(IOError, calls[2].result)
+
+class ManyPool(object):
+    """A pool sending several requests at once like CurlPool, answering
+    like EchoApi in reverse order.  Chunks with a call asking fail='many'
+    fail in open_many() only"""
+
+    def __init__(self):
+        self.batches = []
+        self.opens = 0
+
+    def answer(self, request, many):
+        data = isinstance(request, tuple) and request[1] or request.data
+        if not isinstance(data, str):
+            data = data.decode('utf-8')
+        calls = api.json.loads(parse_qs(data)['api_requestArray'][0])
+        if [c for c in calls if c.get('fail') == 'chunk' or
+                                (many and c.get('fail') == 'many')]:
+            return IOError('connection reset')
+        return BytesIO(api.json.dumps([echo_response(c) for c in calls]).encode('utf-8'))
+
+    def open(self, request):
+        self.opens += 1
+        response = self.answer(request, False)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def open_many(self, requests):
+        self.batches.append(len(requests))
+        for i in reversed(range(len(requests))):
+            yield i, self.answer(requests[i], True)
+
+class RequestsPoolTest(unittest.TestCase):
+    """Runs a RequestsPool against a local HTTP/1.1 server that echoes the
+    n parameter, or answers HTTP 503 to n=fail"""
+
+    def setUp(self):
+        if api.load_transport() != 'requests':
+            self.skipTest('needs requests')
+        try:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+        except ImportError:
+            # Python 3
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        self.connections = []
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                test.connections.append(self.client_address)
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                n = parse_qs(self.rfile.read(length).decode('utf-8'))['n'][0]
+                body = ('{"n": "%s"}' % n).encode('utf-8')
+                self.send_response(n == 'fail' and 503 or 200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        if hasattr(self, 'server'):
+            self.server.shutdown()
+            self.server.server_close()
+
+    def request(self, n):
+        return api.requests_request(self.url, {'n': n}, {})
+
+    def testKeepAlive(self):
+        pool = api.RequestsPool()
+        self.assertEqual(['{"n": "%d"}' % i for i in range(3)],
+                         [pool.open(self.request(i)).read() for i in range(3)])
+        self.assertEqual(b'{"n": "3"}', b''.join(pool.stream(self.request(3))))
+        self.assertEqual(1, len(self.connections))
+        pool.close()
+        pool.open(self.request(4))
+        self.assertEqual(2, len(self.connections))
+        pool.close()
+
+    def testMaxIdle(self):
+        pool = api.RequestsPool(max_idle=0.05)
+        pool.open(self.request(1))
+        pool.open(self.request(2))
+        time.sleep(0.1)
+        pool.open(self.request(3))
+        self.assertEqual(2, len(self.connections))
+        pool.close()
+
+    def testNoKeepAlive(self):
+        pool = api.RequestsPool(keep_alive=False)
+        for i in range(3):
+            pool.open(self.request(i))
+        self.assertEqual(3, len(self.connections))
+
+    def testError(self):
+        pool = api.RequestsPool()
+        try:
+            pool.open(self.request('fail'))
+            self.fail('HTTPError not raised')
+        except api.TRANSPORT_ERRORS as ex:
+            self.assertEqual(503, api._http_status(ex))
+        # the pool keeps working after an error
+        self.assertEqual('{"n": "1"}', pool.open(self.request(1)).read())
+        pool.close()
+
+class FakeCurl(object):
+    """Stands in for a pycurl.Curl handle, keeping its options.  Requests
+    are answered with their fields, and the HTTP status ending their url,
+    if any"""
+
+    def __init__(self):
+        self.options = {}
+
+    def setopt(self, option, value):
+        self.options[option] = value
+
+    def perform(self):
+        body = self.options[VEpycurl.pycurl.POSTFIELDS]
+        self.options[VEpycurl.pycurl.WRITEFUNCTION](body.encode('utf-8'))
+
+    def getinfo(self, info):
+        assert info == VEpycurl.pycurl.RESPONSE_CODE
+        status = self.options[VEpycurl.pycurl.URL].rstrip('/').split('/')[-1]
+        return status.isdigit() and int(status) or 200
+
+class FakeMulti(object):
+    """Stands in for a pycurl.CurlMulti, finishing every running transfer on
+    info_read(); transfers to a url holding 'down' fail"""
+
+    def __init__(self):
+        self.running = []
+        self.most = 0
+
+    def add_handle(self, pco):
+        self.running.append(pco)
+        self.most = max(self.most, len(self.running))
+
+    def remove_handle(self, pco):
+        pass
+
+    def perform(self):
+        return 0, len(self.running)
+
+    def select(self, timeout):
+        return 0
+
+    def info_read(self):
+        done, failed = [], []
+        for pco in reversed(self.running):
+            if 'down' in pco.options[VEpycurl.pycurl.URL]:
+                failed.append((pco, 7, 'Failed to connect'))
+            else:
+                pco.perform()
+                done.append(pco)
+        self.running = []
+        return 0, done, failed
+
+class MultiTest(unittest.TestCase):
+
+    def testOpenMany(self):
+        pool = ManyPool()
+        a = api.Api('x', batching=True, batch_size=2, pool=pool)
+        for i in range(5):
+            a.test_echo(n=i)
+        self.assertEqual(list(range(5)), [r['DATA']['n'] for r in a.batchFlush()])
+        self.assertEqual([3], pool.batches)
+        self.assertEqual(0, pool.opens)
+
+    def testRetry(self):
+        pool = ManyPool()
+        a = api.Api('x', batching=True, batch_size=2, pool=pool, retries=1,
+                    retry_backoff=0.01)
+        for i in range(4):
+            a.test_echo(n=i, fail=i == 3 and 'many' or '')
+        self.assertEqual(list(range(4)), [r['DATA']['n'] for r in a.batchFlush()])
+        self.assertEqual(1, pool.opens)
+        a.retries = 0
+        for i in range(4):
+            a.test_echo(n=i, fail=i == 3 and 'many' or '')
+        self.assertRaises(api.BatchError, a.batchFlush)
+
+    @unittest.skipIf(VEpycurl is None, 'needs pycurl')
+    def testMultiHandle(self):
+        m = VEpycurl.VEpycurlMulti(maxHandles=2)
+        m.multi = FakeMulti()
+        m._newHandle = FakeCurl
+        requests = [('https://%s/' % host, 'n=%d' % i, [])
+                    for i, host in enumerate(['a', 'down', 'c'])]
+        results = dict(m.performMany(requests))
+        self.assertEqual(b'n=0', results[0].read())
+        self.assertTrue(isinstance(results[1], VEpycurl.pycurl.error))
+        self.assertEqual(b'n=2', results[2].read())
+        self.assertEqual(2, m.multi.most)
+        self.assertEqual(2, len(m.handles))
+
+    @unittest.skipIf(VEpycurl is None, 'needs pycurl')
+    def testStatus(self):
+        m = VEpycurl.VEpycurlMulti()
+        m.multi = FakeMulti()
+        m._newHandle = FakeCurl
+        self.assertEqual(b'n=1', m.perform('https://a/', 'n=1', []).read())
+        try:
+            m.perform('https://a/503', 'n=1', [])
+            self.fail('HTTPError not raised')
+        except api.TRANSPORT_ERRORS as ex:
+            # seen by the retries as the API pushing back
+            self.assertEqual(503, api._http_status(ex))
+        self.assertEqual(1, len(m.handles))
+        requests = [('https://a/%s' % status, 'n=%d' % i, [])
+                    for i, status in enumerate(['', '429', '500'])]
+        results = dict(m.performMany(requests))
+        self.assertEqual(b'n=0', results[0].read())
+        self.assertEqual([429, 500], [api._http_status(results[i]) for i in (1, 2)])
+
+class SingleFlightTest(unittest.TestCase):
+
+    def call(self, a, results, **params):
+        try:
+            results.append(a.test_echo(**params))
+        except Exception as ex:
+            results.append(ex)
+
+    def concurrently(self, a, callers, **params):
+        results = []
+        threads = [threading.Thread(target=self.call, args=(a, results),
+                                    kwargs=params) for i in range(callers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def testCollapse(self):
+        a = EchoApi(singleflight=True)
+        results = self.concurrently(a, 4, n=1, delay=0.2)
+        self.assertEqual([{'n': 1, 'delay': 0.2}] * 4, results)
+        self.assertEqual(['test.echo'], a.sent)
+        # errors are shared too, and nothing is left in flight
+        results = self.concurrently(a, 3, n=1, delay=0.2, error=4)
+        self.assertEqual(2, len(a.sent))
+        self.assertEqual([api.ApiError] * 3, [r.__class__ for r in results])
+        a.test_echo(n=1)
+        self.assertEqual(3, len(a.sent))
+
+    def testOff(self):
+        a = EchoApi()
+        self.concurrently(a, 3, n=1, delay=0.1)
+        self.assertEqual(['test.echo'] * 3, a.sent)
+
+    def testBatch(self):
+        a = EchoApi(batching=True, singleflight=True)
+        for i in range(2):
+            a.test_echo(n=1)
+            a.test_write(n=1)
+        results = a.batchFlush()
+        self.assertEqual([{'n': 1}] * 4, [r['DATA'] for r in results])
+        # the reads are sent once, each write goes through
+        self.assertEqual(['test.echo', 'test.write', 'test.write'],
+                         [c['api_action'] for c in a.calls])
+
+class SpanTest(unittest.TestCase):
+
+    def testBatch(self):
+        body = api.json.dumps([
+            {'ACTION': 'linode.disk.createfromdistribution', 'ERRORARRAY': [],
+             'DATA': {'DiskID': 1, 'JobID': 2}},
+            {'ACTION': 'linode.disk.createfromdistribution',
+             'ERRORARRAY': [{'ERRORCODE': 8, 'ERRORMESSAGE': 'busy'}], 'DATA': {}}])
+        exporter = api.InMemoryExporter()
+        a = api.Api('secret-key', batching=True, pool=PiecePool(body),
+                    span_exporter=exporter)
+        for i in range(2):
+            a.linode_disk_createfromdistribution(LinodeID=1, DistributionID=2,
+                                                 Label='d%d' % i, Size=100,
+                                                 rootPass='hunter2',
+                                                 rootSSHKey='ssh-rsa AAAA')
+        a.batchFlush()
+        self.assertEqual(1, len(exporter.spans))
+        span = exporter.spans[0]
+        self.assertEqual(2, span.attributes['calls'])
+        self.assertTrue(span.duration >= 0)
+        self.assertEqual(len(body), span.attributes['response_bytes'])
+        # secrets appear nowhere, not even in the parameters of the calls
+        self.assertTrue('hunter2' not in repr(span.attributes))
+        self.assertTrue('secret-key' not in repr(span.attributes))
+        self.assertEqual(2, len(span.children))
+        for i, child in enumerate(span.children):
+            params = api.LowerCaseDict(child.attributes['params'])
+            self.assertEqual('linode.disk.createfromdistribution', child.name)
+            self.assertEqual('d%d' % i, params['label'])
+            self.assertEqual('rootpass: xxxx REDACTED xxxx', params['rootpass'])
+            self.assertEqual('rootsshkey: xxxx REDACTED xxxx', params['rootsshkey'])
+            self.assertTrue('hunter2' not in repr(child.attributes))
+            # the calls of a batch aren't timed one by one
+            self.assertEqual(None, child.duration)
+            self.assertFalse('response_bytes' in child.attributes)
+        self.assertEqual([True, False], [c.attributes['success'] for c in span.children])
+        self.assertTrue(isinstance(span.children[1].error, api.ApiError))
+
+class BusyApi(EchoApi):
+    """An EchoApi counting the most requests in flight at once"""
+
+    def __init__(self, **kw):
+        EchoApi.__init__(self, **kw)
+        self.active = self.most = 0
+
+    def _Api__send_once(self, request):
+        with self.lock:
+            self.active += 1
+            self.most = max(self.most, self.active)
+        try:
+            return EchoApi._Api__send_once(self, request)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+@unittest.skipIf(api.futures is None, 'needs futures')
+class ConcurrentTest(unittest.TestCase):
+
+    def testSubmit(self):
+        a = EchoApi()
+        self.assertEqual({'n': 1}, a.submit('test_echo', n=1).result(5))
+        self.assertEqual({'n': 2}, a.submit('test.echo', n=2).result(5))
+        failed = a.submit('test_echo', n=3, error=4)
+        self.assertRaises(api.ApiError, failed.result, 5)
+        # arguments are checked before anything is sent
+        self.assertRaises(api.MissingRequiredArgument, a.submit, 'linode_boot')
+        self.assertEqual(3, len(a.sent))
+
+    def testMapOrder(self):
+        a = EchoApi()
+        # the first calls answer last
+        params = [{'n': i, 'delay': (5 - i) * 0.02} for i in range(5)]
+        self.assertEqual(list(range(5)), [r['n'] for r in a.map('test_echo', params)])
+        params[2]['error'] = 4
+        results = a.map('test_echo', params)
+        self.assertEqual([0, 1], [next(results)['n'] for i in range(2)])
+        self.assertRaises(api.ApiError, next, results)
+
+    def testMapWorkers(self):
+        a = BusyApi()
+        params = [{'n': i, 'delay': 0.05} for i in range(6)]
+        self.assertEqual(6, len(list(a.map('test_echo', params, max_workers=2))))
+        self.assertEqual(2, a.most)
+        a = BusyApi(max_workers=3)
+        self.assertEqual(6, len(list(a.map('test_echo', params))))
+        self.assertEqual(3, a.most)
+
+class RecordingHandler(logging.Handler):
+    """Keeps the messages of the records it handles, formatting each"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record, self.format(record)))
+
+class LoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger('linode.api')
+        self.level = self.log.level
+        self.handler = RecordingHandler()
+        self.log.addHandler(self.handler)
+        self.formatted = []
+        self.redacted_str = api.Redacted.__str__
+        test = self
+
+        def counting_str(redacted):
+            test.formatted.append(redacted.request['api_action'])
+            return test.redacted_str(redacted)
+        api.Redacted.__str__ = counting_str
+
+    def tearDown(self):
+        api.Redacted.__str__ = self.redacted_str
+        self.log.removeHandler(self.handler)
+        self.log.setLevel(self.level)
+
+    def flush(self):
+        body = api.json.dumps([{'ACTION': 'linode.disk.createfromdistribution',
+                                'ERRORARRAY': [], 'DATA': {'DiskID': 1}}])
+        a = api.Api('secret-key', batching=True, pool=PiecePool(body))
+        a.linode_disk_createfromdistribution(LinodeID=1, DistributionID=2,
+                                             Label='root', Size=100,
+                                             rootPass='hunter2')
+        return a.batchFlush()
+
+    def testRedacted(self):
+        self.log.setLevel(logging.DEBUG)
+        self.assertEqual({'DiskID': 1}, self.flush()[0]['DATA'])
+        messages = [m for r, m in self.handler.records]
+        self.assertTrue(messages[0].startswith('Batched: '))
+        self.assertTrue('rootpass: xxxx REDACTED xxxx' in messages[0])
+        parameters = [(r, m) for r, m in self.handler.records
+                      if m.startswith('Parameters ')]
+        self.assertEqual(1, len(parameters))
+        record, message = parameters[0]
+        self.assertEqual('batch', record.api_action)
+        self.assertTrue('api_key: xxxx REDACTED xxxx' in message)
+        # the calls inside the batch are redacted too
+        self.assertTrue('rootpass: xxxx REDACTED xxxx' in message)
+        for m in messages:
+            self.assertFalse('secret-key' in m, m)
+            self.assertFalse('hunter2' in m, m)
+        self.assertEqual(set(['linode.disk.createfromdistribution', 'batch']),
+                         set(self.formatted))
+
+    def testDisabled(self):
+        self.log.setLevel(logging.INFO)
+        self.flush()
+        self.assertEqual([], self.handler.records)
+        self.assertEqual([], self.formatted)
+
+class HTTPFailure(IOError):
+    """A transport error carrying an HTTP status, as urllib raises them"""
+
+    def __init__(self, code):
+        IOError.__init__(self, 'HTTP error %d' % code)
+        self.code = code
+
+class FlakyApi(EchoApi):
+    """An EchoApi raising the errors in failures, one per send, first"""
+
+    def __init__(self, failures, **kw):
+        EchoApi.__init__(self, **kw)
+        self.failures = list(failures)
+
+    def _Api__send_once(self, request):
+        if self.failures:
+            self.sent.append(request['api_action'])
+            raise self.failures.pop(0)
+        return EchoApi._Api__send_once(self, request)
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+        self.uniform = api.random.uniform
+        # record the longest wait allowed instead of sleeping
+        api.random.uniform = lambda low, high: self.delays.append(high) or 0
+
+    def tearDown(self):
+        api.random.uniform = self.uniform
+
+    def testTransient(self):
+        a = FlakyApi([HTTPFailure(500), IOError('reset')], retries=2,
+                     retry_backoff=0.5)
+        self.assertEqual({'n': 1}, a.test_echo(n=1))
+        self.assertEqual(['test.echo'] * 3, a.sent)
+        self.assertEqual([0.5, 1.0], self.delays)
+
+    def testGiveUp(self):
+        a = FlakyApi([HTTPFailure(502), HTTPFailure(502)], retries=1)
+        self.assertRaises(HTTPFailure, a.test_echo, n=1)
+        self.assertEqual(2, len(a.sent))
+        # HTTP errors below 500 aren't transient
+        a = FlakyApi([HTTPFailure(404)], retries=1)
+        self.assertRaises(HTTPFailure, a.test_echo, n=1)
+        self.assertEqual(1, len(a.sent))
+
+    def testWrite(self):
+        a = FlakyApi([HTTPFailure(500)], retries=2)
+        self.assertRaises(HTTPFailure, a.test_write, n=1)
+        self.assertEqual(['test.write'], a.sent)
+
+    def testPushback(self):
+        bucket = api.TokenBucket(64)
+        error = api.ApiError([{'ERRORCODE': 8, 'ERRORMESSAGE': 'busy'}])
+        a = FlakyApi([HTTPFailure(429), error], retries=2, rate_limit=bucket,
+                     retry_errorcodes=(8,))
+        # pushback is retried even for calls that write
+        self.assertEqual({'n': 1}, a.test_write(n=1))
+        self.assertEqual(3, len(a.sent))
+        self.assertEqual(64 / 4 + 64 / 16, bucket.rate)
+        a = FlakyApi([api.ApiError([{'ERRORCODE': 9, 'ERRORMESSAGE': 'no'}])],
+                     retries=2, retry_errorcodes=(8,))
+        self.assertRaises(api.ApiError, a.test_echo, n=1)
+
+class CountingBucket(api.TokenBucket):
+    """A TokenBucket counting the tokens taken"""
+
+    taken = 0
+
+    def acquire(self, tokens=1):
+        self.taken += tokens
+        api.TokenBucket.acquire(self, tokens)
+
+@unittest.skipIf(api.futures is None, 'needs futures')
+class HedgeTest(unittest.TestCase):
+
+    def testFast(self):
+        a = EchoApi(hedge=True, hedge_delay=0.5)
+        self.assertEqual({'n': 1}, a.test_echo(n=1))
+        self.assertEqual(['test.echo'], a.sent)
+
+    def testDuplicate(self):
+        bucket = CountingBucket(1000)
+        a = EchoApi(hedge=True, hedge_delay=0.05, rate_limit=bucket)
+        a.delays = [0.4, 0]
+        started = time.time()
+        self.assertEqual({'n': 1}, a.test_echo(n=1))
+        self.assertTrue(time.time() - started < 0.3)
+        self.assertEqual(['test.echo'] * 2, a.sent)
+        self.assertEqual(2, bucket.taken)
+        # measured from the first send, not from the duplicate's
+        self.assertTrue(a._Api__latencies['test.echo'][0] >= 0.05)
+
+    def testWrite(self):
+        a = EchoApi(hedge=True, hedge_delay=0.01)
+        a.delays = [0.05]
+        a.linode_boot(LinodeID=1)
+        self.assertEqual(['linode.boot'], a.sent)
+
+    def testError(self):
+        a = EchoApi(hedge=True, hedge_delay=0.05)
+        a.delays = [0.2, 0]
+        self.assertRaises(api.ApiError, a.test_echo, error=5)
+        self.assertEqual(2, len(a.sent))
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio needs Python 3.5')
+class AsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def testStreaming(self):
+        import aio
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': [{'LINODEID': 1, 'LABEL': 'a'}]})
+        a = aio.AsyncApi('x', pool=FuturePool(body))
+        self.assertRaises(Exception, a.iter_linode_list)
+        self.assertRaises(Exception, a.linode_list, fields=['LABEL'])
+        self.assertEqual('a', self.loop.run_until_complete(a.linode_list())[0]['LABEL'])
+
+    def testColumns(self):
+        import aio
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'linode.list',
+                               'DATA': [{'LINODEID': 1, 'TOTALRAM': 1024},
+                                        {'LINODEID': 2, 'TOTALRAM': 2048}]})
+        a = aio.AsyncApi('x', pool=FuturePool(body))
+        c = self.loop.run_until_complete(a.linode_list(columns=True))
+        self.assertEqual([1024, 2048], list(c['totalram']))
+
+    def testThreaded(self):
+        import aio
+        for option in ('autobatch', 'retries', 'hedge', 'singleflight',
+                       'rate_limit', 'collect_stats'):
+            self.assertRaises(TypeError, aio.AsyncApi, 'x', **{option: 1})
+        a = aio.AsyncApi('x', retries=0, pool=FuturePool('{}'))
+        self.assertRaises(TypeError, a.submit, 'test_echo', n=1)
+        self.assertRaises(TypeError, a.map, 'test_echo', [{'n': 1}])
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio needs Python 3.5')
+class AsyncPoolTest(unittest.TestCase):
+    """Runs an AsyncPool against a local server answering each request with
+    the next of responses, closing the connection after those marked so"""
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.responses = []
+        self.connections = []
+        self.requests = []
+        test = self
+
+        class Server(asyncio.Protocol):
+
+            def connection_made(self, transport):
+                test.connections.append(transport)
+                self.transport = transport
+                self.buffer = b''
+
+            def data_received(self, data):
+                self.buffer += data
+                while b'\r\n\r\n' in self.buffer:
+                    head, rest = self.buffer.split(b'\r\n\r\n', 1)
+                    length = [int(l.split(b':')[1]) for l in head.split(b'\r\n')
+                              if l.lower().startswith(b'content-length:')][0]
+                    if len(rest) < length:
+                        return
+                    self.buffer = rest[length:]
+                    test.requests.append(parse_qs(rest[:length].decode('utf-8')))
+                    response, close = test.responses.pop(0)
+                    self.transport.write(response)
+                    if close:
+                        self.transport.close()
+
+        self.server = self.loop.run_until_complete(
+            self.loop.create_server(Server, '127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%d/' % self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def open(self, pool, n):
+        return self.loop.run_until_complete(
+            pool.open(self.url, {'api_action': 'test.echo', 'n': n}, {}))
+
+    def testKeepAlive(self):
+        import aio
+        pool = aio.AsyncPool()
+        self.responses = [
+            (b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\none', False),
+            (b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\ntwo', True),
+            # the pool finds its idle connection closed and opens another
+            (b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n'
+             b'Connection: close\r\n\r\nthree', False),
+            (b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nfour', False),
+        ]
+        self.assertEqual(b'one', self.open(pool, 1))
+        self.assertEqual(b'two', self.open(pool, 2))
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual(b'three', self.open(pool, 3))
+        self.assertEqual(b'four', self.open(pool, 4))
+        self.assertEqual(3, len(self.connections))
+        self.assertEqual(['1', '2', '3', '4'], [r['n'][0] for r in self.requests])
+        pool.close()
+
+    def testChunked(self):
+        import aio
+        pool = aio.AsyncPool()
+        self.responses = [
+            (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+             b'4\r\n{"a"\r\n'
+             b'9;name=value\r\n: [1, 2]}\r\n'
+             b'0\r\nX-Trailer: 1\r\n\r\n', False),
+            (b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n', False),
+        ]
+        self.assertEqual(b'{"a": [1, 2]}', self.open(pool, 1))
+        # the connection is reused after a chunked body and its trailers
+        self.assertRaises(IOError, self.open, pool, 2)
+        self.assertEqual(1, len(self.connections))
+        pool.close()
+
+class TextPool(PiecePool):
+    """A PiecePool handing its body over as text, like the requests transport"""
+
+    def read(self):
+        return self.body.decode('utf-8')
+
+class StatsTest(unittest.TestCase):
+
+    def testPercentiles(self):
+        h = api._Histogram(keep=100)
+        for v in range(1, 201):
+            h.add(v)
+        summary = h.summary()
+        self.assertEqual((200, 1, 200), (summary['count'], summary['min'], summary['max']))
+        self.assertEqual(100.5, summary['mean'])
+        # the percentiles only cover the 100 values kept
+        self.assertEqual((151, 190, 199), (summary['p50'], summary['p90'], summary['p99']))
+
+    def testSizes(self):
+        body = api.json.dumps({'ERRORARRAY': [], 'ACTION': 'test.echo',
+                               'DATA': {'LABEL': u'caf\u00e9'}}, ensure_ascii=False)
+        size = len(body.encode('utf-8'))
+        samples = []
+        for pool in (PiecePool(body), TextPool(body)):
+            a = api.Api('x', pool=pool, stats_hook=lambda action, sample: samples.append(sample))
+            self.assertEqual(u'caf\u00e9', a.test_echo()['LABEL'])
+            stats = a.stats()['test.echo']
+            self.assertEqual((1, 0), (stats['requests'], stats['errors']))
+            self.assertEqual(size, stats['response_bytes']['max'])
+        self.assertEqual([size, size], [s['response_bytes'] for s in samples])
+        self.assertTrue(samples[0]['network'] >= 0 and samples[0]['error'] is None)
+
+    def testErrors(self):
+        body = '{"ERRORARRAY":[{"ERRORCODE":5,"ERRORMESSAGE":"x"}],' \
+               '"DATA":{},"ACTION":"test.echo"}'
+        a = api.Api('x', pool=PiecePool(body), collect_stats=True)
+        self.assertRaises(api.ApiError, a.test_echo)
+        self.assertEqual(1, a.stats()['test.echo']['errors'])
+        a.reset_stats()
+        self.assertEqual({}, a.stats())
+
 if __name__ == "__main__":
     if 'LINODE_API_KEY' not in os.environ:
         os.environ['LINODE_API_KEY'] = getpass('Enter API Key: ')
@@ -0,0 +1,182 @@
+# vim:ts=2:sw=2:expandtab
+"""
+Run a graph of dependent Linode API calls in as few round trips as possible.
+
+Each call added to a Workflow may use fields from the results of earlier
+calls.  When the workflow runs, every call whose inputs are known is sent in
+one batch, so the number of round trips is the length of the longest chain of
+calls rather than the number of calls:
+
+  flow = Workflow(api.Api(key))
+  linode = flow.add('linode_create', DatacenterID=2, PlanID=1, PaymentTerm=1)
+  disk = flow.add('linode_disk_createfromdistribution',
+                  LinodeID=linode['LinodeID'], DistributionID=60,
+                  rootPass=password, Label='root', Size=20000)
+  flow.add('linode_boot', LinodeID=linode['LinodeID'], after=[disk])
+  flow.run()
+  print(linode.result['LinodeID'])
+
+This code is provided under an MIT-style license. Please refer to the LICENSE
+file in the root of the project for specifics.
+"""
+
+from api import Api, ApiError, ApiInfo, BatchError, LowerCaseDict
+
+class Ref(object):
+  """A field of a step's result, filled in when the step has run"""
+
+  def __init__(self, step, field, convert=None):
+    self.step = step
+    self.field = field
+    self.convert = convert
+
+  def map(self, convert):
+    """Returns a Ref to this field passed through convert"""
+    if self.convert is None:
+      return Ref(self.step, self.field, convert)
+    inner = self.convert
+    return Ref(self.step, self.field, lambda value: convert(inner(value)))
+
+  def resolve(self):
+    value = LowerCaseDict(self.step.result)[self.field]
+    if self.convert is not None:
+      value = self.convert(value)
+    return value
+
+class StepFailed(Exception):
+  """Set as the error of a step that was skipped because a step it depends
+  on failed."""
+
+  def __init__(self, value):
+    self.value = value
+  def __str__(self):
+    return repr(self.value)
+  def __reduce__(self):
+    return (self.__class__, (self.value, ))
+
+class Step(object):
+  """One API call in a Workflow.
+
+  After the workflow has run, result holds the DATA of the call and error
+  is None, or error holds the ApiError (or StepFailed, or the error of the
+  batch it was sent in) and result is None.
+  """
+
+  def __init__(self, action, params, after):
+    self.action = action
+    self.params = params
+    self.depends = set(after)
+    for v in params.values():
+      if isinstance(v, Ref):
+        self.depends.add(v.step)
+    self.depth = 1 + max([s.depth for s in self.depends] or [0])
+    self.result = None
+    self.error = None
+
+  def __getitem__(self, field):
+    return Ref(self, field)
+
+  def resolved_params(self):
+    params = {}
+    for k, v in self.params.items():
+      if isinstance(v, Ref):
+        v = v.resolve()
+      params[k] = v
+    return params
+
+class Workflow(object):
+  """A graph of API calls, run in waves of batch requests.
+
+  Instantiate with: Workflow(api)
+
+  Add calls with add(), which returns a Step.  Indexing a step, as in
+  step['LinodeID'], gives a reference to a field of its result that may be
+  passed as a parameter to later calls.  Calls that must wait for a step
+  without using its result can list it in after.
+  """
+
+  def __init__(self, api):
+    self.api = api
+    self.steps = []
+
+  def add(self, action, after=(), **params):
+    """Adds a call to the workflow and returns its Step.  Raises
+    MissingRequiredArgument straight away if a required parameter is
+    missing."""
+    name = action.replace('.', '_')
+    if name in ApiInfo.request_builders:
+      ApiInfo.request_builders[name](self.api, params)
+    step = Step(name, params, after)
+    self.steps.append(step)
+    return step
+
+  def waves(self):
+    """Returns the steps grouped into the batches they will be sent in"""
+    waves = {}
+    for s in self.steps:
+      waves.setdefault(s.depth, []).append(s)
+    return [waves[d] for d in sorted(waves.keys())]
+
+  def run(self):
+    """Runs every step, returning their results in the order they were
+    added.  Failed steps, and steps depending on them, have a result of
+    None and their error set.
+
+    Raises Exception if calls are already queued for a batch on the Api,
+    as their responses would be taken for those of the steps.
+    """
+    if isinstance(self.api, Api) and self.api._Api__batch_cache:
+      raise Exception('%d calls are already batched on this Api, '
+                      'flush them before running a workflow'
+                      % len(self.api._Api__batch_cache))
+    for wave in self.waves():
+      ready = []
+      for s in wave:
+        failed = [d for d in s.depends if d.error is not None]
+        if failed:
+          s.error = StepFailed('%s skipped, %s failed' % (s.action, failed[0].action))
+          continue
+        try:
+          ready.append((s, s.resolved_params()))
+        except Exception as ex:
+          # a field missing from the result of a step it depends on
+          s.error = StepFailed('%s skipped, its parameters failed: %r'
+                               % (s.action, ex))
+      if ready:
+        self.__send(ready)
+    return [s.result for s in self.steps]
+
+  def __send(self, ready):
+    steps = [s for s, params in ready]
+    if self.api.autobatch:
+      pending = [getattr(self.api, s.action)(**params) for s, params in ready]
+      self.api.batchFlush()
+      for s, f in zip(steps, pending):
+        try:
+          s.result = f.result()
+        except Exception as ex:
+          # an ApiError of its own, or the failure of its chunk
+          s.error = ex
+      return
+
+    batching = self.api.batching
+    self.api.batching = True
+    try:
+      for s, params in ready:
+        getattr(self.api, s.action)(**params)
+      responses = self.api.batchFlush()
+    except BatchError as ex:
+      # some chunks went through, their steps must not be sent again
+      responses = ex.results
+    finally:
+      self.api.batching = batching
+
+    for s, r in zip(steps, responses):
+      if isinstance(r, Exception):
+        s.error = r
+        continue
+      r = LowerCaseDict(r)
+      if len(r['ERRORARRAY']) > 0 and r['ERRORARRAY'][0]['ERRORCODE'] != 0:
+        s.error = ApiError(r['ERRORARRAY'])
+      else:
+        s.result = r['DATA']
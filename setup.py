@@ -10,5 +10,7 @@ setup(
     packages = ['linode'],
     extras_require = {
         'requests': ["requests"],
+        'futures': ['futures; python_version < "3"'],
+        'numpy': ['numpy'],
     },
 )